@@ -0,0 +1,77 @@
+"""Serialization helpers for the JSON API.
+
+Records are plain dicts built from query rows; nothing here touches the
+models, so the same helpers serve paginated responses and NDJSON streams.
+"""
+
+import datetime
+import json
+from itertools import islice
+
+
+def parse_fields(value, available):
+    """Return the fields requested by ``?fields=``, in the order given.
+
+    Raises ValueError naming the first unknown field.
+    """
+    if not value:
+        return tuple(available)
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    for field in fields:
+        if field not in available:
+            raise ValueError('Unknown field {!r}'.format(field))
+    return fields
+
+
+def parse_limit(value, default, maximum):
+    limit = int(value) if value else default
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
+
+
+def parse_minutes(value, name):
+    """Whole number of minutes, 0 when absent; raises ValueError naming the
+    parameter."""
+    try:
+        minutes = int(value) if value else 0
+    except ValueError:
+        raise ValueError('{} must be a whole number of minutes'.format(name))
+    if minutes < 0:
+        raise ValueError('{} must not be negative'.format(name))
+    return minutes
+
+
+def parse_datetime(value, name):
+    """ISO 8601 date or date and time, as naive local time like the app's
+    other times; raises ValueError naming the parameter."""
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError('{} must be an ISO 8601 date or date and time'.format(name))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def dumps(obj):
+    return json.dumps(obj, default=_default, separators=(',', ':'))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def ndjson(records):
+    for record in records:
+        yield dumps(record) + '\n'
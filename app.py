@@ -3,26 +3,47 @@
 #----------------------------------------------------------------------------#
 
 import os
+import sys
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from werkzeug.exceptions import NotFound
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, session, jsonify, stream_with_context
+from database import SQLAlchemy
+from sqlalchemy import or_, and_, func, tuple_, literal, bindparam, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+import click
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
-from flask_migrate import Migrate
+# forms (WTForms), babel, dateutil.parser and recommend (NumPy) are imported
+# where they are used, which keeps them out of the start-up of every worker
+from search import SearchIndexes
+from cache import create_cache
+from api import parse_fields, parse_limit, parse_minutes, parse_datetime, dumps, chunked, ndjson
+from importer import RowValidator, Checkpoint, read_rows, parse_bool, copy_rows
+from recurrence import last_occurrence, occurrences_from, occurrences_until, count_until
+from geo import Gazetteer, geohash, bounding_boxes, covering_cells, distance_km, in_range, parse_location
+from availability import overlapping_pairs, free_slots
+from http_cache import conditional, templates_modified
+from config import get_config
+from metrics import registry
+from profiling import Profiler
+from jobs import JobQueue, worker_name
 import datetime
+import heapq
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import groupby, islice
+from functools import lru_cache, partial
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
 app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
+app.config.from_object(get_config())
+profiler = Profiler(app)
 
 # TODO: connect to a local postgresql database
 
@@ -30,14 +51,99 @@ app.config.from_object('config')
 #print(app.config['SQLALCHEMY_DATABASE_URI'])
 db = SQLAlchemy(app)
 
-migrate = Migrate(app, db)
+if app.config['CLI_MIGRATIONS']:
+  # Flask-Migrate loads alembic, which only the `flask db` commands need
+  from flask_migrate import Migrate
+  migrate = Migrate(app, db)
+
+page_cache = create_cache(app.config)
+
+
+def pool_gauge(key):
+  def read():
+    status = db.pool_status()
+    return status and status[key]
+  return read
+
+for key in ('size', 'checked_out', 'idle', 'overflow'):
+  registry.gauge('fyyur_db_pool_' + key, 'Database pool connections: ' + key.replace('_', ' '), pool_gauge(key))
+
+for key in ('hits', 'misses', 'evictions', 'expirations'):
+  registry.gauge('fyyur_page_cache_' + key, 'Page cache ' + key + ' since start',
+                 lambda key=key: page_cache.stats()[key])
+
+registry.gauge('fyyur_db_replicas_healthy', 'Read replicas that passed their last health check',
+               lambda: sum(replica.healthy for replica in db.replicas.replicas) if db.replicas else None)
+
+
+def pinned_to_primary():
+  # for DATABASE_PRIMARY_PIN_SECONDS after a write a session reads the
+  # primary, and so its own writes
+  return session.get('primary_until', 0) > time.time()
+
+@app.before_request
+def route_reads():
+  # Reads may trail the primary by up to DATABASE_REPLICA_MAX_LAG seconds, and
+  # a page cached from such a read is then served for up to CACHE_TTL
+  if request.method in ('GET', 'HEAD') and not pinned_to_primary():
+    db.session().use_replica(db.replicas)
+
+@app.after_request
+def pin_writers(response):
+  if db.session().info.get('wrote'):
+    session['primary_until'] = time.time() + app.config['DATABASE_PRIMARY_PIN_SECONDS']
+  return response
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+def trigram_index(name, column):
+    # GIN trigram index on postgres (see the search migration), used by
+    # the ILIKE '%term%' searches
+    return db.Index(name, column, postgresql_using='gin',
+                    postgresql_ops={column: 'gin_trgm_ops'})
+
+class Genre(db.Model):
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def get_or_create(cls, names):
+        # one query for the genres that already exist, the rest are added
+        names = list(dict.fromkeys(name for name in names if name))
+        genres = {genre.name: genre
+                  for genre in cls.query.filter(cls.name.in_(names))} if names else {}
+        for name in names:
+            if name not in genres:
+                genres[name] = cls(name=name)
+                db.session.add(genres[name])
+        return [genres[name] for name in names]
+
+# genre -> entity lookups are served by the (genre_id, entity_id) indexes
+venue_genres = db.Table('venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey(Genre.id, ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id')
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey(Genre.id, ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id')
+)
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        trigram_index('ix_Venue_name_trgm', 'name'),
+        trigram_index('ix_Venue_city_trgm', 'city'),
+        db.Index('ix_Venue_state_city', 'state', 'city'),
+        # radius queries read geohash prefix ranges; postgres also has a GiST
+        # index on point(longitude, latitude), see the migration
+        db.Index('ix_Venue_geohash', 'geohash'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -54,13 +160,31 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
-    genres = db.Column(db.String(200))
-
-    show = db.relationship('Show', backref='venue', lazy=True)
+    # shows and series occurrences after the counts watermark, see
+    # record_show_counts()
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # set together by venue_location(), usually from a gazetteer (see
+    # `flask geocode`); NULL for venues that have not been placed
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    # when the venue's page last changed, its Last-Modified; also moved by
+    # invalidate_pages() for changes to its shows, series and counterparts
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now,
+                           onupdate=datetime.datetime.now)
+    genres = db.relationship(Genre, secondary=venue_genres, order_by=Genre.name)
+
+    # shows are removed by the database's ON DELETE CASCADE
+    show = db.relationship('Show', backref='venue', lazy=True,
+                           cascade='all, delete-orphan', passive_deletes=True)
 
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        trigram_index('ix_Artist_name_trgm', 'name'),
+        trigram_index('ix_Artist_city_trgm', 'city'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -75,39 +199,1169 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
-    genres = db.Column(db.String(200))
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now,
+                           onupdate=datetime.datetime.now)
+    genres = db.relationship(Genre, secondary=artist_genres, order_by=Genre.name)
 
-    show = db.relationship('Show', backref='artist', lazy=True)
+    show = db.relationship('Show', backref='artist', lazy=True,
+                           cascade='all, delete-orphan', passive_deletes=True)
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
 class Show(db.Model):
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+    # exclusive; at most SHOW_MAX_DURATION_MINUTES after start_time, which
+    # bounds the index range searched for overlapping shows. On postgres
+    # exclusion constraints keep the shows of a venue or an artist apart
+    end_time = db.Column(db.DateTime, nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey(Artist.id, ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey(Venue.id, ondelete='CASCADE'), nullable=False)
+
+
+class ShowSeries(db.Model):
+    # a show repeating on an RRULE (see recurrence.py); its occurrences are
+    # never stored, listings expand them for the page being displayed
+    __table_args__ = (
+        db.Index('ix_show_series_venue_id_last_start_time', 'venue_id', 'last_start_time'),
+        db.Index('ix_show_series_artist_id_last_start_time', 'artist_id', 'last_start_time'),
+        db.Index('ix_show_series_last_start_time', 'last_start_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    rule = db.Column(db.String(500), nullable=False)
+    # first and last occurrence, so listings only expand the series that
+    # overlap the page
+    start_time = db.Column(db.DateTime, nullable=False)
+    last_start_time = db.Column(db.DateTime, nullable=False)
+    # minutes each occurrence lasts
+    duration = db.Column(db.Integer, nullable=False, server_default='120')
+    artist_id = db.Column(db.Integer, db.ForeignKey(Artist.id, ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey(Venue.id, ondelete='CASCADE'), nullable=False)
+
+
+class ShowCountWatermark(db.Model):
+    # single row: shows starting at or before swept_until have been aged out
+    # of the upcoming_show_count columns
+    id = db.Column(db.Integer, primary_key=True)
+    swept_until = db.Column(db.DateTime, nullable=False)
+
+
+class Job(db.Model):
+    # background work queued for `flask worker`, see jobs.py
+    __table_args__ = (
+        db.Index('ix_job_run_at', 'run_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime)
-    artist_id = db.Column(db.Integer, db.ForeignKey(Artist.id))
-    venue_id = db.Column(db.Integer, db.ForeignKey(Venue.id))
+    name = db.Column(db.String(100), nullable=False)
+    kwargs = db.Column(db.Text, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    locked_until = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(200))
+    last_error = db.Column(db.Text)
+    failed_at = db.Column(db.DateTime)
+    # periodic jobs: seconds between runs, and the task name as a unique key
+    every = db.Column(db.Integer)
+    key = db.Column(db.String(100), unique=True)
+
+
+# Summaries of the listing pages' queries, refreshed by refresh_listing(). On
+# postgres the migration makes them materialized views, with the unique
+# indexes a concurrent refresh needs; elsewhere they are plain tables.
+venue_listing = db.Table('venue_listing',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String),
+    db.Column('city', db.String(120)),
+    db.Column('state', db.String(120)),
+    db.Column('num_upcoming_shows', db.Integer),
+    db.Index('ix_venue_listing_state_city_id', 'state', 'city', 'id')
+)
+
+artist_listing = db.Table('artist_listing',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String),
+    db.Column('num_upcoming_shows', db.Integer)
+)
+
+# the shows that were upcoming at the refresh, as show tiles
+show_feed = db.Table('show_feed',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('start_time', db.DateTime),
+    db.Column('venue_id', db.Integer),
+    db.Column('venue_name', db.String),
+    db.Column('artist_id', db.Integer),
+    db.Column('artist_name', db.String),
+    db.Column('artist_image_link', db.String(500)),
+    db.Index('ix_show_feed_start_time_id', 'start_time', 'id')
+)
+
+
+class ListingRefresh(db.Model):
+    # when each listing summary was last brought up to date
+    name = db.Column(db.String(50), primary_key=True)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
+
+jobs = JobQueue(db, Job.__table__)
+
+for key in ('queued', 'failed'):
+  registry.gauge('fyyur_jobs_' + key, 'Background jobs ' + key, lambda key=key: jobs.status()[key])
+
+
+def entity_genres(model):
+  # association table linking model to Genre, and its column referencing model
+  if model is Venue:
+    return venue_genres, venue_genres.c.venue_id
+  return artist_genres, artist_genres.c.artist_id
+
+def genre_names_query(model, ids=None):
+  table, entity_id = entity_genres(model)
+  query = db.session.query(entity_id, Genre.name) \
+                    .join(Genre, Genre.id == table.c.genre_id) \
+                    .order_by(Genre.name)
+  if ids is not None:
+    query = query.filter(entity_id.in_(ids))
+  return query
+
+def genre_names(model, ids=None):
+  # {entity id: [genre name, ...]} for the given entities in one query
+  genres = {}
+  for owner_id, name in genre_names_query(model, ids):
+    genres.setdefault(owner_id, []).append(name)
+  return genres
+
+def search_documents(model, ids=None):
+  # (id, (name, city, genres)) for the in-process search index
+  query = db.session.query(model.id, model.name, model.city)
+  if ids is not None:
+    query = query.filter(model.id.in_(ids))
+  genres = genre_names(model, ids)
+  for rec in query:
+    yield rec.id, (rec.name, rec.city, ', '.join(genres.get(rec.id, [])))
+
+search_indexes = SearchIndexes(max_age=app.config['SEARCH_INDEX_MAX_AGE'])
+search_indexes.register(Venue, lambda ids=None: search_documents(Venue, ids))
+search_indexes.register(Artist, lambda ids=None: search_documents(Artist, ids))
+search_indexes.listen()
 
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format):
+  # babel re-parses the pattern on every format_datetime call; imported here
+  # as it takes a while to load and only pages with dates need it
+  import babel.dates
+  return (babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)),
+          babel.Locale.parse(babel.dates.LC_TIME))
+
+@lru_cache(maxsize=4096)
+def cached_format_datetime(value, format):
+  pattern, locale = datetime_pattern(format)
+  if value.tzinfo is None:
+    # babel treats naive datetimes as UTC
+    value = value.replace(tzinfo=datetime.timezone.utc)
+  return pattern.apply(value, locale)
+
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+  # views pass datetimes; strings are still parsed for the old callers
+  if isinstance(value, str):
+    import dateutil.parser
+    value = dateutil.parser.parse(value)
+  return cached_format_datetime(value, format)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def show_listing_query():
+  # only the columns a show tile needs, venue and artist joined in the same query
+  return db.session.query(
+            Show.id,
+            Show.start_time,
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Show.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link')
+  ).join(Venue, Venue.id == Show.venue_id) \
+   .join(Artist, Artist.id == Show.artist_id) \
+   .order_by(Show.start_time, Show.id)
+
+# show tile columns of show_listing_query, shared by series occurrences
+SHOW_TILE_FIELDS = ('venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link')
+
+def upcoming_shows_count(model):
+  # maintained by record_show_counts() and the sweeper, at most a sweep
+  # interval behind the shows that have started
+  return model.upcoming_show_count.label('num_upcoming_shows')
+
+def filter_by_genre(query, model, genre):
+  # served by the (genre_id, entity_id) index on the association table
+  table, entity_id = entity_genres(model)
+  return query.join(table, entity_id == model.id) \
+              .join(Genre, Genre.id == table.c.genre_id) \
+              .filter(Genre.name == genre)
+
+def venue_listing_query(genre=None):
+  query = db.session.query(
+            Venue.id,
+            Venue.name,
+            Venue.city,
+            Venue.state,
+            upcoming_shows_count(Venue)
+  )
+  if genre:
+    query = filter_by_genre(query, Venue, genre)
+  return query.order_by(Venue.state, Venue.city, Venue.id)
+
+def venue_location(coordinates):
+  # column values placing a venue at (latitude, longitude), or nowhere
+  latitude, longitude = coordinates or (None, None)
+  return {'latitude': latitude, 'longitude': longitude,
+          'geohash': geohash(latitude, longitude) if coordinates else None}
+
+def nearby_venues_query(latitude, longitude, radius):
+  # venues in the bounding box of the circle: postgres reads them from the
+  # GiST index on point(longitude, latitude), anything else from ranges of
+  # the geohash index
+  boxes = bounding_boxes(latitude, longitude, radius)
+  if db.engine.dialect.name == 'postgresql':
+    location = func.point(Venue.longitude, Venue.latitude)
+    within = [location.op('<@')(func.box(func.point(west, south), func.point(east, north)))
+              for south, west, north, east in boxes]
+  else:
+    # '~' sorts after every geohash character
+    within = [and_(Venue.geohash >= cell, Venue.geohash < cell + '~')
+              for cell in covering_cells(boxes)]
+  return db.session.query(Venue.id, Venue.latitude, Venue.longitude).filter(or_(*within))
+
+def nearby_venues(latitude, longitude, radius):
+  # the venues within radius km, nearest first, in the search results'
+  # shape; only the listed ones are read beyond their coordinates
+  found = []
+  for venue_id, venue_latitude, venue_longitude in nearby_venues_query(latitude, longitude, radius):
+    distance = distance_km(latitude, longitude, venue_latitude, venue_longitude)
+    if distance <= radius:
+      found.append((distance, venue_id))
+  nearest = heapq.nsmallest(app.config['NEARBY_RESULTS_LIMIT'], found)
+  venues = {venue.id: venue for venue in db.session.query(
+              Venue.id,
+              Venue.name,
+              Venue.city,
+              Venue.state,
+              Venue.latitude,
+              Venue.longitude,
+              upcoming_shows_count(Venue)
+  ).filter(Venue.id.in_([venue_id for distance, venue_id in nearest]))} if nearest else {}
+  return {
+    'count': len(found),
+    'data': [{
+      'id': venue_id,
+      'name': venues[venue_id].name,
+      'city': venues[venue_id].city,
+      'state': venues[venue_id].state,
+      'latitude': venues[venue_id].latitude,
+      'longitude': venues[venue_id].longitude,
+      'distance_km': round(distance, 2),
+      'num_upcoming_shows': venues[venue_id].num_upcoming_shows,
+    } for distance, venue_id in nearest if venue_id in venues]
+  }
+
+def artist_listing_query(genre=None):
+  query = db.session.query(Artist.id, Artist.name, upcoming_shows_count(Artist))
+  if genre:
+    query = filter_by_genre(query, Artist, genre)
+  return query.order_by(Artist.id)
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_entities(model, search_term):
+  # partial, case-insensitive match on name, city and genres, best match
+  # first; postgres answers from its trigram indexes, anything else from
+  # the in-process index
+  limit = app.config['SEARCH_RESULTS_LIMIT']
+
+  if db.engine.dialect.name == 'postgresql':
+    pattern = '%{}%'.format(escape_like(search_term))
+    rank = func.greatest(func.similarity(model.name, search_term),
+                         func.similarity(model.city, search_term))
+    matches = db.session.query(
+              model.id,
+              rank.label('rank'),
+              func.count().over().label('total')
+    ).filter(or_(model.name.ilike(pattern, escape='\\'),
+                 model.city.ilike(pattern, escape='\\'),
+                 model.genres.any(Genre.name.ilike(pattern, escape='\\')))) \
+     .order_by(rank.desc(), model.id) \
+     .limit(limit) \
+     .subquery()
+    results = db.session.query(
+              model.id,
+              model.name,
+              upcoming_shows_count(model),
+              matches.c.total
+    ).join(matches, matches.c.id == model.id) \
+     .order_by(matches.c.rank.desc(), model.id) \
+     .all()
+    count = results[0].total if results else 0
+  else:
+    ids = search_indexes.search(model, search_term)
+    count = len(ids)
+    ids = ids[:limit]
+    results = db.session.query(
+              model.id,
+              model.name,
+              upcoming_shows_count(model)
+    ).filter(model.id.in_(ids)).all() if ids else []
+    order = {entity_id: position for position, entity_id in enumerate(ids)}
+    results.sort(key=lambda rec: order[rec.id])
+
+  return {
+        'count': count,
+        'data': [{
+                  'id': rec.id,
+                  'name': rec.name,
+                  'num_upcoming_shows': rec.num_upcoming_shows
+        } for rec in results]
+  }
+
+def show_cursor(show):
+  # opaque keyset cursor for the ?after= parameter
+  return '{}_{}'.format(show.start_time.isoformat(), show.id)
+
+def parse_show_cursor(cursor):
+  # raises ValueError on a malformed cursor
+  start_time, show_id = cursor.rsplit('_', 1)
+  return datetime.datetime.fromisoformat(start_time), int(show_id)
+
+def after_show_cursor(query, cursor):
+  # a row-value comparison lets the (start_time, id) index seek to the cursor
+  return query.filter(tuple_(Show.start_time, Show.id) > parse_show_cursor(cursor))
+
+def show_feed_bound(now, after=None):
+  # the key the /shows page's shows come after: the cursor, or now once the
+  # cursor is in the past, since the page lists upcoming shows
+  bound = (now, math.inf)
+  return max(bound, parse_show_cursor(after)) if after else bound
+
+def show_feed_query(bound, summary=False):
+  # shows after the (start_time, id) key bound in listing order, from the
+  # show_feed summary or from show_listing_query
+  if summary:
+    query = db.session.query(show_feed).order_by(show_feed.c.start_time, show_feed.c.id)
+    start_time, show_id = show_feed.c.start_time, show_feed.c.id
+  else:
+    query, start_time, show_id = show_listing_query(), Show.start_time, Show.id
+  if bound[1] == math.inf:
+    return query.filter(start_time > bound[0])
+  return query.filter(tuple_(start_time, show_id) > bound)
+
+def show_sides(model, source=Show):
+  # (show or series column referencing model, the other entity, column
+  # referencing it, and the prefix its fields take in a show tile)
+  if model is Venue:
+    return source.venue_id, Artist, source.artist_id, 'artist'
+  return source.artist_id, Venue, source.venue_id, 'venue'
+
+def entity_shows_query(model, entity_id, when, now, after=None):
+  # upcoming shows soonest first or past shows latest first, with the other
+  # side of each show joined in
+  own_id, counterpart, counterpart_id, prefix = show_sides(model)
+  query = db.session.query(
+            Show.id,
+            Show.start_time,
+            counterpart.id.label(prefix + '_id'),
+            counterpart.name.label(prefix + '_name'),
+            counterpart.image_link.label(prefix + '_image_link')
+  ).join(counterpart, counterpart.id == counterpart_id) \
+   .filter(own_id == entity_id)
+  key = tuple_(Show.start_time, Show.id)
+  if when == 'upcoming':
+    query = query.filter(Show.start_time > now).order_by(Show.start_time, Show.id)
+    if after:
+      query = query.filter(key > parse_show_cursor(after))
+  else:
+    query = query.filter(Show.start_time <= now).order_by(Show.start_time.desc(), Show.id.desc())
+    if after:
+      query = query.filter(key < parse_show_cursor(after))
+  return query
+
+def entity_series_query(model, entity_id):
+  # the entity's series with the columns of entity_shows_query
+  own_id, counterpart, counterpart_id, prefix = show_sides(model, ShowSeries)
+  return db.session.query(
+            ShowSeries.id,
+            ShowSeries.rule,
+            ShowSeries.start_time,
+            counterpart.id.label(prefix + '_id'),
+            counterpart.name.label(prefix + '_name'),
+            counterpart.image_link.label(prefix + '_image_link')
+  ).join(counterpart, counterpart.id == counterpart_id) \
+   .filter(own_id == entity_id)
+
+def entity_shows_bound(when, now, after=None):
+  # (key the page's shows come after, whether latest first); upcoming shows
+  # start after now, past ones at or before it
+  return (parse_show_cursor(after) if after else (now, math.inf)), when == 'past'
+
+def entity_shows_page(model, entity_id, when, now, after=None):
+  # (show tiles, cursor of the next page or None)
+  limit = app.config['DETAIL_SHOWS_LIMIT']
+  rows = entity_shows_query(model, entity_id, when, now, after).limit(limit + 1).all()
+  bound, descending = entity_shows_bound(when, now, after)
+  series = overlapping_series(entity_series_query(model, entity_id), bound, rows, limit, descending)
+  return entity_show_tiles(model, rows, series, bound, descending)
+
+def entity_show_tiles(model, rows, series, bound, descending):
+  # entity_shows_page's result from its limit + 1 rows and overlapping series
+  limit = app.config['DETAIL_SHOWS_LIMIT']
+  prefix = show_sides(model)[3]
+  rows = with_series_occurrences(rows, series, (prefix + '_id', prefix + '_name', prefix + '_image_link'),
+                                 limit + 1, bound, descending)
+  next_cursor = show_cursor(rows[limit - 1]) if len(rows) > limit else None
+  return [row._asdict() for row in rows[:limit]], next_cursor
+
+def entity_show_counts_queries(model, entity_id, now):
+  # (upcoming and past shows counted over the (entity, start_time) index,
+  # the entity's series)
+  own_id = show_sides(model)[0]
+  series_own_id = show_sides(model, ShowSeries)[0]
+  counts = db.session.query(
+            func.count(Show.id).filter(Show.start_time > now).label('upcoming'),
+            func.count(Show.id).filter(Show.start_time <= now).label('past')
+  ).filter(own_id == entity_id)
+  return counts, db.session.query(ShowSeries.rule, ShowSeries.start_time).filter(series_own_id == entity_id)
+
+def with_series_counts(counts, series, now):
+  # (upcoming, past) counts plus the occurrences of series on either side of now
+  upcoming, past = counts
+  for row in series:
+    series_past, series_upcoming = count_until(row.rule, row.start_time, now)
+    upcoming += series_upcoming
+    past += series_past
+  return upcoming, past
+
+def entity_show_counts(model, entity_id, now):
+  counts, series = entity_show_counts_queries(model, entity_id, now)
+  return with_series_counts(counts.one(), series, now)
+
+#----------------------------------------------------------------------------#
+# Page data.
+#----------------------------------------------------------------------------#
+
+# The views pass these the results of the queries above; asgi.py passes them
+# the same queries' results fetched by its async driver.
+
+def venue_areas(results):
+  # rows of venue_listing_query, grouped by state and city
+  formatted_result = []
+  for (state, city), area_venues in groupby(results, key=lambda rec: (rec.state, rec.city)):
+    formatted_result.append({
+            "city": city,
+            "state": state,
+            "venues": [{
+                        "id": rec.id,
+                        "name": rec.name,
+                        "num_upcoming_shows": rec.num_upcoming_shows
+            } for rec in area_venues]
+    })
+  return formatted_result
+
+def venue_page_data(venue, genres, upcoming, past, counts):
+  # upcoming and past are entity_shows_page results, counts
+  # entity_show_counts'
+  (upcoming_shows, upcoming_cursor), (past_shows, past_cursor) = upcoming, past
+  upcoming_shows_count, past_shows_count = counts
+  return {
+            'id': venue.id,
+            'name': venue.name,
+            'genres': genres,
+            'address': venue.address,
+            'city': venue.city,
+            'state': venue.state,
+            'phone': venue.phone,
+            'website': venue.website,
+            'facebook_link': venue.facebook_link,
+            'seeking_talent': venue.seeking_talent,
+            'seeking_description': venue.seeking_description,
+            'image_link': venue.image_link,
+            'past_shows': past_shows,
+            'upcoming_shows': upcoming_shows,
+            'past_shows_count': past_shows_count,
+            'upcoming_shows_count': upcoming_shows_count,
+            'past_shows_cursor': past_cursor,
+            'upcoming_shows_cursor': upcoming_cursor
+  }
+
+def artist_page_data(artist, genres, upcoming, past, counts):
+  # as venue_page_data
+  (upcoming_shows, upcoming_cursor), (past_shows, past_cursor) = upcoming, past
+  upcoming_shows_count, past_shows_count = counts
+  return {
+            'id': artist.id,
+            'name': artist.name,
+            'genres': genres,
+            'city': artist.city,
+            'state': artist.state,
+            'phone': artist.phone,
+            'website': artist.website,
+            'facebook_link': artist.facebook_link,
+            'seeking_venue': artist.seeking_venue,
+            'seeking_description': artist.seeking_description,
+            'image_link': artist.image_link,
+            'past_shows': past_shows,
+            'upcoming_shows': upcoming_shows,
+            'past_shows_count': past_shows_count,
+            'upcoming_shows_count': upcoming_shows_count,
+            'past_shows_cursor': past_cursor,
+            'upcoming_shows_cursor': upcoming_cursor
+  }
+
+def show_listing_page(rows, series, bound):
+  # (show tiles, cursor of the next page or None) from up to SHOWS_PER_PAGE
+  # + 1 rows of show_listing_query past bound and the series overlapping them
+  limit = app.config['SHOWS_PER_PAGE']
+  rows = with_series_occurrences(rows, series, SHOW_TILE_FIELDS, limit + 1, bound)
+
+  next_cursor = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_cursor = show_cursor(rows[-1])
+
+  formatted_result = []
+  for show in rows:
+    formatted_result.append({
+              'venue_id': show.venue_id,
+              'venue_name': show.venue_name,
+              'artist_id': show.artist_id,
+              'artist_name': show.artist_name,
+              'artist_image_link': show.artist_image_link,
+              'start_time': show.start_time
+    })
+  return formatted_result, next_cursor
+
+#----------------------------------------------------------------------------#
+# Show series.
+#----------------------------------------------------------------------------#
+
+class Record(dict):
+  # a row built or fetched outside the ORM (series occurrences, asgi.py's
+  # results), read like the ORM's rows
+  __getattr__ = dict.__getitem__
+
+  def _asdict(self):
+    return dict(self)
+
+def show_key(show):
+  # listing order of shows and occurrences; the occurrences of series N take
+  # the id -N, which keeps keys unique so cursors work across both
+  return show.start_time, show.id
+
+def series_listing_query():
+  # series with the columns of show_listing_query
+  return db.session.query(
+            ShowSeries.id,
+            ShowSeries.rule,
+            ShowSeries.start_time,
+            ShowSeries.venue_id,
+            Venue.name.label('venue_name'),
+            ShowSeries.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link')
+  ).join(Venue, Venue.id == ShowSeries.venue_id) \
+   .join(Artist, Artist.id == ShowSeries.artist_id)
+
+def overlapping_series_query(query, bound, rows, limit, descending=False):
+  # the series of query that can have occurrences on the page: past bound
+  # and, when the page holds more than limit shows, not beyond the last one
+  edge = rows[-1].start_time if len(rows) > limit else None
+  if descending:
+    query = query.filter(ShowSeries.start_time <= bound[0])
+    if edge is not None:
+      query = query.filter(ShowSeries.last_start_time >= edge)
+  else:
+    if bound is not None:
+      query = query.filter(ShowSeries.last_start_time >= bound[0])
+    if edge is not None:
+      query = query.filter(ShowSeries.start_time <= edge)
+  return query
+
+def overlapping_series(query, bound, rows, limit, descending=False):
+  return overlapping_series_query(query, bound, rows, limit, descending).all()
+
+def series_occurrences(series, fields, bound=None, descending=False):
+  # occurrences of a series row after the (start_time, id) key bound, soonest
+  # first, or before it and latest first when descending
+  occurrence_id = -series.id
+  shared = {field: getattr(series, field) for field in fields}
+  if descending:
+    times = occurrences_until(series.rule, series.start_time, bound[0])
+  else:
+    times = occurrences_from(series.rule, series.start_time, bound and bound[0])
+  for start_time in times:
+    key = (start_time, occurrence_id)
+    if bound is None or (key < bound if descending else key > bound):
+      yield Record(shared, id=occurrence_id, start_time=start_time)
+
+def with_series_occurrences(rows, series, fields, limit, bound=None, descending=False):
+  # the first limit of rows and the occurrences of series merged in listing
+  # order; rows must hold the first limit shows past bound. Only as many
+  # occurrences are generated as the page needs.
+  occurrences = [series_occurrences(row, fields, bound, descending) for row in series]
+  return list(islice(heapq.merge(rows, *occurrences, key=show_key, reverse=descending), limit))
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+def cached_page(key, render):
+  # flashed messages are rendered into the page, so requests with pending
+  # ones neither read nor fill the cache
+  if '_flashes' in session:
+    return render()
+  page = page_cache.get(key)
+  if page is None:
+    page = render()
+    page_cache.set(key, page)
+  return page
+
+def touch_entities(venue_ids=(), artist_ids=()):
+  # moves updated_at, the stamp of the pages' validators, of the venues and
+  # artists whose pages changed
+  now = datetime.datetime.now()
+  for model, entity_ids in ((Venue, venue_ids), (Artist, artist_ids)):
+    # SQLite allows 999 parameters
+    for chunk in chunked(sorted(set(entity_ids)), 500):
+      db.session.query(model).filter(model.id.in_(chunk)) \
+                .update({model.updated_at: now}, synchronize_session=False)
+
+def invalidate_pages(venue_ids=(), artist_ids=()):
+  # called after the write's commit
+  if venue_ids or artist_ids:
+    try:
+      touch_entities(venue_ids, artist_ids)
+      db.session.commit()
+    except:
+      db.session.rollback()
+      app.logger.exception('Could not move the updated_at of changed pages')
+  page_cache.delete(*(['venue:{}'.format(venue_id) for venue_id in set(venue_ids)] +
+                      ['artist:{}'.format(artist_id) for artist_id in set(artist_ids)]))
+  if app.config['CACHE_BACKEND'] != 'memory' and (venue_ids or artist_ids):
+    # the cache is shared with the worker, which renders the pages again
+    # before the next visitor asks for them
+    try:
+      jobs.enqueue('warm_pages', venue_ids=sorted(set(venue_ids)), artist_ids=sorted(set(artist_ids)))
+      db.session.commit()
+    except:
+      db.session.rollback()
+      app.logger.exception('Could not queue the warm-up of pages')
+
+@jobs.task()
+def warm_pages(venue_ids=(), artist_ids=()):
+  with app.test_request_context():
+    for key, render, entity_ids in (('venue:{}', render_venue_page, venue_ids),
+                                    ('artist:{}', render_artist_page, artist_ids)):
+      for entity_id in entity_ids:
+        try:
+          page_cache.set(key.format(entity_id), render(entity_id))
+        except NotFound:
+          # deleted since
+          pass
+
+def existing_show_references(venue_ids, artist_ids):
+  # the given venue and artist ids that exist, found with one query
+  venues = db.session.query(literal('venue'), Venue.id).filter(Venue.id.in_(set(venue_ids)))
+  artists = db.session.query(literal('artist'), Artist.id).filter(Artist.id.in_(set(artist_ids)))
+  found = {'venue': set(), 'artist': set()}
+  for kind, entity_id in venues.union_all(artists):
+    found[kind].add(entity_id)
+  return found['venue'], found['artist']
+
+def show_reference_errors(data, venue_ids, artist_ids):
+  # form style errors for a show whose venue or artist is not among the ids
+  errors = {}
+  if data['venue_id'] not in venue_ids:
+    errors['venue_id'] = ['No venue with this id.']
+  if data['artist_id'] not in artist_ids:
+    errors['artist_id'] = ['No artist with this id.']
+  return errors
+
+def show_counterpart_ids(model, entity_id):
+  # ids of the entities sharing a show or a series with entity_id, whose
+  # pages mention it
+  own_id, counterpart, counterpart_id, prefix = show_sides(model)
+  series_own_id, counterpart, series_counterpart_id, prefix = show_sides(model, ShowSeries)
+  shows = db.session.query(counterpart_id).filter(own_id == entity_id)
+  series = db.session.query(series_counterpart_id).filter(series_own_id == entity_id)
+  return [rec[0] for rec in shows.union(series)]
+
+#----------------------------------------------------------------------------#
+# Upcoming show counts.
+#----------------------------------------------------------------------------#
+
+# Venue and Artist keep upcoming_show_count, the number of their shows and
+# series occurrences starting after the watermark. Writes compute their
+# deltas against the watermark and queue them for a worker to apply, and the
+# periodic sweep moves the watermark to now, subtracting what started in
+# between, so the listing and search pages read counts that are at most a
+# sweep interval and the job queue's backlog behind.
+
+def counts_watermark(lock=False):
+  # writers share the watermark row, so a sweep moving it waits for them and
+  # they wait for the sweep
+  watermark = db.session.query(ShowCountWatermark).with_for_update(read=not lock) \
+                .filter(ShowCountWatermark.id == 1).first()
+  if watermark is None:
+    # created by the migration; databases made with create_all() start empty
+    watermark = ShowCountWatermark(id=1, swept_until=datetime.datetime.now())
+    db.session.add(watermark)
+    db.session.flush()
+  return watermark
+
+def adjust_upcoming_counts(venue_deltas, artist_deltas):
+  # one executemany UPDATE per table for all the changed ids
+  for model, deltas in ((Venue, venue_deltas), (Artist, artist_deltas)):
+    params = [{'entity_id': entity_id, 'delta': delta} for entity_id, delta in deltas.items() if delta]
+    if params:
+      table = model.__table__
+      db.session.execute(table.update()
+                         .where(table.c.id == bindparam('entity_id'))
+                         .values(upcoming_show_count=table.c.upcoming_show_count + bindparam('delta')),
+                         params)
+
+def queue_count_deltas(venue_deltas, artist_deltas):
+  # the UPDATEs of the venue and artist rows, which every write to their
+  # shows contends for, run in a worker instead of the writing request
+  venues = {venue_id: delta for venue_id, delta in venue_deltas.items() if delta}
+  artists = {artist_id: delta for artist_id, delta in artist_deltas.items() if delta}
+  if venues or artists:
+    jobs.enqueue('apply_count_deltas', venues=venues, artists=artists)
+
+@jobs.task()
+def apply_count_deltas(venues, artists):
+  # ids come back from JSON as strings; sharing the watermark keeps
+  # reconcile-counts from running meanwhile
+  counts_watermark()
+  adjust_upcoming_counts({int(venue_id): delta for venue_id, delta in venues.items()},
+                         {int(artist_id): delta for artist_id, delta in artists.items()})
+
+def pending_count_deltas(model):
+  # deltas queued but not applied yet, by entity id
+  key = 'venues' if model is Venue else 'artists'
+  pending = Counter()
+  queued = db.session.query(Job.kwargs).filter(Job.name == 'apply_count_deltas', Job.failed_at.is_(None))
+  for kwargs, in queued:
+    for entity_id, delta in json.loads(kwargs)[key].items():
+      pending[int(entity_id)] += delta
+  return pending
+
+def record_show_counts(shows, sign=1):
+  # shows are (venue_id, artist_id, start_time) being added (sign=1) or
+  # removed (sign=-1) in the current transaction
+  swept_until = counts_watermark().swept_until
+  venue_deltas, artist_deltas = Counter(), Counter()
+  for venue_id, artist_id, start_time in shows:
+    if start_time > swept_until:
+      venue_deltas[venue_id] += sign
+      artist_deltas[artist_id] += sign
+  queue_count_deltas(venue_deltas, artist_deltas)
+
+def record_series_counts(series, sign=1):
+  # as record_show_counts, for ShowSeries rows and their occurrences
+  swept_until = counts_watermark().swept_until
+  venue_deltas, artist_deltas = Counter(), Counter()
+  for row in series:
+    upcoming = count_until(row.rule, row.start_time, swept_until)[1]
+    venue_deltas[row.venue_id] += sign * upcoming
+    artist_deltas[row.artist_id] += sign * upcoming
+  queue_count_deltas(venue_deltas, artist_deltas)
+
+@jobs.task()
+def sweep_upcoming_counts(now=None):
+  # subtracts the shows and occurrences that started after the watermark and
+  # at or before now, then moves the watermark to now; returns how many
+  now = now or datetime.datetime.now()
+  watermark = counts_watermark(lock=True)
+  swept_until = watermark.swept_until
+  if now <= swept_until:
+    return 0
+  venue_deltas, artist_deltas = Counter(), Counter()
+  started = db.session.query(Show.venue_id, Show.artist_id, func.count(Show.id)) \
+              .filter(Show.start_time > swept_until, Show.start_time <= now) \
+              .group_by(Show.venue_id, Show.artist_id)
+  series = db.session.query(ShowSeries.venue_id, ShowSeries.artist_id,
+                            ShowSeries.rule, ShowSeries.start_time) \
+             .filter(ShowSeries.last_start_time > swept_until, ShowSeries.start_time <= now)
+  for venue_id, artist_id, count in started:
+    venue_deltas[venue_id] -= count
+    artist_deltas[artist_id] -= count
+  for venue_id, artist_id, rule, start_time in series:
+    count = count_until(rule, start_time, now)[0] - count_until(rule, start_time, swept_until)[0]
+    venue_deltas[venue_id] -= count
+    artist_deltas[artist_id] -= count
+  adjust_upcoming_counts(venue_deltas, artist_deltas)
+  watermark.swept_until = now
+  return -sum(venue_deltas.values())
+
+def actual_upcoming_counts(model, swept_until):
+  # the counts recomputed from the shows and series, by entity id
+  own_id = show_sides(model)[0]
+  series_own_id = show_sides(model, ShowSeries)[0]
+  counts = Counter(dict(db.session.query(own_id, func.count(Show.id))
+                                  .filter(Show.start_time > swept_until)
+                                  .group_by(own_id)))
+  series = db.session.query(series_own_id, ShowSeries.rule, ShowSeries.start_time) \
+             .filter(ShowSeries.last_start_time > swept_until)
+  for entity_id, rule, start_time in series:
+    counts[entity_id] += count_until(rule, start_time, swept_until)[1]
+  return counts
+
+def upcoming_count_drift(model):
+  # (id, stored, actual) of the entities whose stored count, with the deltas
+  # still queued, is wrong; takes the watermark exclusively so no write,
+  # delta or sweep is applied meanwhile
+  actual = actual_upcoming_counts(model, counts_watermark(lock=True).swept_until)
+  pending = pending_count_deltas(model)
+  return [(entity_id, stored + pending[entity_id], actual[entity_id])
+          for entity_id, stored in db.session.query(model.id, model.upcoming_show_count)
+          if stored + pending[entity_id] != actual[entity_id]]
+
+jobs.schedule('sweep_upcoming_counts', app.config['UPCOMING_COUNT_SWEEP_INTERVAL'])
+
+#----------------------------------------------------------------------------#
+# Venue locations.
+#----------------------------------------------------------------------------#
+
+@lru_cache(maxsize=1)
+def load_gazetteer(path):
+  # read once per process, the worker's geocoding jobs sharing it
+  return Gazetteer.load(path)
+
+def locate_venues(gazetteer, venues):
+  # one executemany UPDATE placing each (id, city, state) at its city, or
+  # nowhere when the gazetteer does not know it; returns how many it placed
+  params = [dict(venue_location(gazetteer.locate(city, state)), venue_id=venue_id)
+            for venue_id, city, state in venues]
+  if params:
+    table = Venue.__table__
+    db.session.execute(table.update().where(table.c.id == bindparam('venue_id')), params)
+  return sum(1 for values in params if values['geohash'])
+
+def queue_geocode(venue_ids):
+  # in the caller's transaction; without a gazetteer the venues stay
+  # unplaced until `flask geocode` runs
+  if app.config['GAZETTEER_PATH'] and venue_ids:
+    jobs.enqueue('geocode_venues', venue_ids=sorted(set(venue_ids)))
+
+@jobs.task()
+def geocode_venues(venue_ids):
+  gazetteer = load_gazetteer(app.config['GAZETTEER_PATH'])
+  locate_venues(gazetteer, db.session.query(Venue.id, Venue.city, Venue.state)
+                                     .filter(Venue.id.in_(venue_ids)).all())
+
+#----------------------------------------------------------------------------#
+# Availability.
+#----------------------------------------------------------------------------#
+
+# bookings checked per UNION ALL query, two SELECTs each (SQLite allows 500)
+CONFLICT_QUERY_CHUNK = 200
+
+def show_end_time(start_time, duration=None):
+  return start_time + datetime.timedelta(minutes=duration or app.config['SHOW_DEFAULT_DURATION_MINUTES'])
+
+def show_duration_errors(data):
+  if (data.get('duration') or 0) > app.config['SHOW_MAX_DURATION_MINUTES']:
+    return {'duration': ['A show lasts at most {} minutes.'.format(app.config['SHOW_MAX_DURATION_MINUTES'])]}
+  return {}
+
+def longest_show():
+  return datetime.timedelta(minutes=app.config['SHOW_MAX_DURATION_MINUTES'])
+
+def overlapping_shows_query(own_id, entity_id, start, end):
+  # a show overlapping [start, end) started less than the longest show
+  # before start, so this is one short range of the (own_id, start_time)
+  # index however many shows came before
+  return db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time) \
+                   .filter(own_id == entity_id,
+                           Show.start_time > start - longest_show(),
+                           Show.start_time < end,
+                           Show.end_time > start)
+
+def overlapping_series_occurrences(series, start, end):
+  # (start, end) of the occurrences of a series overlapping [start, end)
+  length = datetime.timedelta(minutes=series.duration)
+  for occurrence in occurrences_from(series.rule, series.start_time, start - length):
+    if occurrence >= end:
+      break
+    if occurrence + length > start:
+      yield occurrence, occurrence + length
+
+def booking_conflicts(bookings):
+  # {position: bookings overlapping the one at position}, each a
+  # (venue_id, artist_id, start, end, show_id) tuple with a show_id of None
+  # for series occurrences and the bookings themselves
+  conflicts = defaultdict(set)
+
+  # stored shows, a bounded index range per booking and side
+  for offset in range(0, len(bookings), CONFLICT_QUERY_CHUNK):
+    queries = [overlapping_shows_query(own_id, entity_id, start, end)
+               .add_columns(literal(position).label('position'))
+               for position, (venue_id, artist_id, start, end) in
+                 enumerate(bookings[offset:offset + CONFLICT_QUERY_CHUNK], offset)
+               for own_id, entity_id in ((Show.venue_id, venue_id), (Show.artist_id, artist_id))]
+    for row in queries[0].union_all(*queries[1:]):
+      conflicts[row.position].add((row.venue_id, row.artist_id, row.start_time, row.end_time, row.id))
+
+  # series of the same venues and artists that are running in the window
+  # of the bookings, expanded over each booking only
+  window_start = min(start for venue_id, artist_id, start, end in bookings) - longest_show()
+  window_end = max(end for venue_id, artist_id, start, end in bookings)
+  series_by_side = defaultdict(list)
+  for series in ShowSeries.query.filter(
+      or_(ShowSeries.venue_id.in_({booking[0] for booking in bookings}),
+          ShowSeries.artist_id.in_({booking[1] for booking in bookings})),
+      ShowSeries.last_start_time > window_start,
+      ShowSeries.start_time < window_end):
+    series_by_side['venue', series.venue_id].append(series)
+    series_by_side['artist', series.artist_id].append(series)
+  if series_by_side:
+    for position, (venue_id, artist_id, start, end) in enumerate(bookings):
+      for series in set(series_by_side['venue', venue_id] + series_by_side['artist', artist_id]):
+        for occurrence_start, occurrence_end in overlapping_series_occurrences(series, start, end):
+          conflicts[position].add((series.venue_id, series.artist_id, occurrence_start, occurrence_end, None))
+
+  # and the bookings among themselves
+  sides = [(side, booking[index], booking[2], booking[3])
+           for booking in bookings for index, side in ((0, 'venue'), (1, 'artist'))]
+  for first, second in overlapping_pairs([((side, entity_id), start, end)
+                                          for side, entity_id, start, end in sides]):
+    first, second = first // 2, second // 2
+    conflicts[first].add(tuple(bookings[second]) + (None,))
+    conflicts[second].add(tuple(bookings[first]) + (None,))
+  return conflicts
+
+def conflict_errors(booking, conflicts):
+  # form style errors naming what keeps the venue or the artist busy
+  venue_id, artist_id, start, end = booking
+  messages = []
+  for other_venue_id, other_artist_id, other_start, other_end, show_id in sorted(conflicts, key=lambda c: c[2]):
+    booked = ' (show {})'.format(show_id) if show_id else ''
+    for side, own_id, other_id in (('Venue', venue_id, other_venue_id), ('Artist', artist_id, other_artist_id)):
+      if own_id == other_id:
+        messages.append('{} {} is booked from {:%Y-%m-%d %H:%M} to {:%Y-%m-%d %H:%M}{}.'.format(
+          side, own_id, other_start, other_end, booked))
+  return {'start_time': messages} if messages else {}
+
+def is_booking_conflict(error):
+  # postgres' exclusion constraints catch overlaps committed concurrently
+  return isinstance(error, IntegrityError) and getattr(error.orig, 'pgcode', None) == '23P01'
+
+def busy_intervals(model, entity_id, start, end):
+  # shows and series occurrences of the venue or artist overlapping [start, end)
+  own_id = show_sides(model)[0]
+  busy = [(row.start_time, row.end_time) for row in overlapping_shows_query(own_id, entity_id, start, end)]
+  series_own_id = show_sides(model, ShowSeries)[0]
+  for series in ShowSeries.query.filter(series_own_id == entity_id,
+                                        ShowSeries.last_start_time > start - longest_show(),
+                                        ShowSeries.start_time < end):
+    busy.extend(overlapping_series_occurrences(series, start, end))
+  return sorted(busy)
+
+#----------------------------------------------------------------------------#
+# Recommendations.
+#----------------------------------------------------------------------------#
+
+def artist_matrix():
+  # every artist's place and genres, and their past shows counted by genre
+  # of the venue played, read into a recommend.ArtistMatrix; plain result
+  # rows, as there are a few hundred thousand of them
+  from recommend import ArtistMatrix
+  history = db.session.query(Show.artist_id, venue_genres.c.genre_id, func.count(Show.id)) \
+                      .join(venue_genres, venue_genres.c.venue_id == Show.venue_id) \
+                      .filter(Show.start_time < datetime.datetime.now()) \
+                      .group_by(Show.artist_id, venue_genres.c.genre_id)
+  artists = db.session.query(Artist.id, Artist.city, Artist.state, Artist.seeking_venue)
+  genres = db.session.query(artist_genres.c.artist_id, artist_genres.c.genre_id)
+  return ArtistMatrix(*(db.session.execute(query.statement).fetchall()
+                        for query in (artists, genres, history)))
+
+@lru_cache(maxsize=1)
+def artist_matrices():
+  # built on the first recommendation a process serves, not at start-up
+  from recommend import MatrixCache
+  return MatrixCache(artist_matrix, app.config['RECOMMEND_MATRIX_MAX_AGE'])
+
+def recommended_artists(venue, limit):
+  # the best limit artists for the venue, each with its score and the parts
+  # the score is made of
+  genre_ids = [genre_id for genre_id, in db.session.query(venue_genres.c.genre_id)
+                                                   .filter(venue_genres.c.venue_id == venue.id)]
+  ranked = artist_matrices().get().rank(genre_ids, venue.city, venue.state, limit,
+                                        app.config['RECOMMEND_WEIGHTS'])
+  ids = [artist_id for artist_id, score, parts in ranked]
+  artists = {artist.id: artist for artist in
+             db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, Artist.image_link,
+                              Artist.seeking_venue, Artist.seeking_description)
+                       .filter(Artist.id.in_(ids))}
+  genres = genre_names(Artist, ids)
+  return [dict(artists[artist_id]._asdict(), genres=genres.get(artist_id, []),
+               score=round(score, 4), score_parts={name: round(value, 4) for name, value in parts.items()})
+          for artist_id, score, parts in ranked if artist_id in artists]
+
+#----------------------------------------------------------------------------#
+# Listing summaries.
+#----------------------------------------------------------------------------#
+
+# /venues, /artists and /shows read summaries of their queries, one indexed
+# read with nothing joined or aggregated, while the summary is at most
+# LISTING_MAX_STALENESS seconds old. Workers refresh each every
+# LISTING_REFRESH_INTERVAL seconds. The pages run the live queries instead
+# when a summary is older (no worker running, say), for genre filters, and
+# for sessions pinned to the primary, which see their own writes.
+
+LISTING_SUMMARIES = {
+  'venue_listing': venue_listing,
+  'artist_listing': artist_listing,
+  'show_feed': show_feed,
+}
+
+def listing_sources(now):
+  # the queries each summary holds the rows of, in its columns' order; the
+  # materialized views of the migration repeat them in SQL
+  return {
+    'venue_listing': venue_listing_query(),
+    'artist_listing': artist_listing_query(),
+    'show_feed': show_listing_query().filter(Show.start_time > now),
+  }
+
+def venue_summary_query():
+  # venue_listing_query's rows, in its order
+  return db.session.query(venue_listing) \
+                   .order_by(venue_listing.c.state, venue_listing.c.city, venue_listing.c.id)
+
+def artist_summary_query():
+  return db.session.query(artist_listing).order_by(artist_listing.c.id)
+
+def is_materialized_view(name):
+  return db.engine.dialect.name == 'postgresql' and db.session.execute(
+    text('SELECT 1 FROM pg_matviews WHERE matviewname = :name'), {'name': name}).first() is not None
+
+def refresh_listing(name, now=None):
+  # brings the summary up to date in the current transaction; readers see the
+  # previous rows until it commits, and a concurrent refresh of a
+  # materialized view only writes the rows that changed
+  now = now or datetime.datetime.now()
+  table = LISTING_SUMMARIES[name]
+  if is_materialized_view(name):
+    db.session.execute(text('REFRESH MATERIALIZED VIEW CONCURRENTLY {}'.format(name)))
+  else:
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select([column.name for column in table.c],
+                                                  listing_sources(now)[name].statement))
+  db.session.merge(ListingRefresh(name=name, refreshed_at=now))
+
+for name in LISTING_SUMMARIES:
+  jobs.task('refresh_' + name)(partial(refresh_listing, name))
+  jobs.schedule('refresh_' + name, app.config['LISTING_REFRESH_INTERVAL'][name])
+
+def is_fresh_listing(name):
+  # the condition on the ListingRefresh row of a summary still within its
+  # staleness bound
+  refreshed_after = datetime.datetime.now() - \
+                    datetime.timedelta(seconds=app.config['LISTING_MAX_STALENESS'][name])
+  return and_(ListingRefresh.name == name, ListingRefresh.refreshed_at >= refreshed_after)
+
+def fresh_listing(name, query, limit=None):
+  # query over the summary called name, which returns nothing unless the
+  # summary is fresh
+  query = query.join(ListingRefresh, is_fresh_listing(name))
+  return query.limit(limit) if limit else query
+
+def listing_rows(name, summary, live, limit=None):
+  # the rows of the summary query while it is fresh, else of the live one;
+  # an empty summary is read live too, which costs little as long as the
+  # live query finds nothing either
+  if not pinned_to_primary():
+    rows = fresh_listing(name, summary, limit).all()
+    if rows:
+      return rows
+  return (live.limit(limit) if limit else live).all()
+
+#----------------------------------------------------------------------------#
+# Page stamps.
+#----------------------------------------------------------------------------#
+
+# When what a page shows last changed, read before the page is built; see
+# http_cache.py. A page built from a summary changes when it is refreshed,
+# a venue or artist page when the row's updated_at moves.
+
+def home_stamp():
+  return templates_modified(app.jinja_loader.searchpath[0])
+
+def listing_stamp_query(name):
+  # the refresh time of the summary, while the listing page reads it
+  return db.session.query(ListingRefresh.refreshed_at.label('stamp')).filter(is_fresh_listing(name))
+
+def entity_stamp_query(model, entity_id):
+  return db.session.query(model.updated_at.label('stamp')).filter(model.id == entity_id)
+
+def with_time_bucket(stamp):
+  # shows pass from upcoming to past with no write at all, so the pages
+  # listing them change every HTTP_CACHE_TIME_BUCKET seconds too
+  if stamp is None:
+    return None
+  bucket = app.config['HTTP_CACHE_TIME_BUCKET']
+  now = time.time()
+  return max(stamp, datetime.datetime.fromtimestamp(now - now % bucket))
+
+def query_stamp(query):
+  row = query.first()
+  return row.stamp if row else None
+
+def listing_stamp(name, timed=False):
+  # None for the requests the listing pages answer from their live queries;
+  # a stale summary has no stamp
+  if pinned_to_primary() or request.args.get('genre'):
+    return None
+  stamp = query_stamp(listing_stamp_query(name))
+  return with_time_bucket(stamp) if timed else stamp
+
+def entity_stamp(model, entity_id):
+  return with_time_bucket(query_stamp(entity_stamp_query(model, entity_id)))
+
+def venue_stamp(venue_id):
+  return entity_stamp(Venue, venue_id)
+
+def artist_stamp(artist_id):
+  return entity_stamp(Artist, artist_id)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 @app.route('/')
+@conditional(home_stamp)
 def index():
   return render_template('pages/home.html')
 
@@ -115,7 +1369,35 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+def render_show_tiles(model, entity_id):
+  when = request.args.get('when')
+  if when not in ('upcoming', 'past'):
+    abort(400)
+  try:
+    found = db.session.query(model.id).filter(model.id == entity_id).first() is not None
+  except:
+    abort(500)
+  if not found:
+    abort(404)
+
+  try:
+    shows, next_cursor = entity_shows_page(model, entity_id, when, datetime.datetime.now(),
+                                           request.args.get('after'))
+  except ValueError:
+    abort(400)
+  except:
+    abort(500)
+
+  response = Response(render_template('pages/show_tiles.html', shows=shows,
+                                      counterpart=show_sides(model)[3]))
+  if next_cursor:
+    response.headers['X-Next-Page'] = url_for(request.endpoint, when=when, after=next_cursor,
+                                              **request.view_args)
+  return response
+
+
 @app.route('/venues')
+@conditional(lambda: listing_stamp('venue_listing'))
 def venues():
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
@@ -143,49 +1425,16 @@ def venues():
   }]
   '''
 
-  # group the result into state and city
+  # one read of the venue_listing summary or, filtered by genre, one query,
+  # already ordered for grouping into state and city
   try:
-    results = Venue.query.outerjoin(Show, Venue.id == Show.venue_id).order_by(Venue.state, Venue.city).all()
+    genre = request.args.get('genre')
+    live = venue_listing_query(genre)
+    results = live.all() if genre else listing_rows('venue_listing', venue_summary_query(), live)
   except:
     abort(500)
 
-  formatted_result = []
-  empty = False
-
-  # get the iterator and loop through it to build the required result
-  if results:
-    iter_results = iter(results)
-    rec = next(iter_results)
-    now = datetime.datetime.now()
-    while not empty:
-      city = rec.city
-      state = rec.state
-      tmp = {
-              "city": city,
-              "state": state,
-              "venues": []
-      }
-      while empty == False and city == rec.city and state == rec.state:
-        upcoming_show = 0
-        for show in rec.show:
-          if show.artist:
-
-            # count the upcoming shows 
-            if show.start_time > now:
-              upcoming_show = upcoming_show + 1
-        tmp["venues"].append({
-                              "id": rec.id,
-                              "name": rec.name,
-                              "num_upcoming_shows": upcoming_show
-        })
-        try:
-          rec = next(iter_results)
-        except:
-          empty = True
-
-      formatted_result.append(tmp)
-
-  data = formatted_result
+  data = venue_areas(results)
   return render_template('pages/venues.html', areas=data)
 
 @app.route('/venues/search', methods=['POST'])
@@ -213,29 +1462,44 @@ def search_venues():
 
   # check for a valid search_term 
   if search_term and not search_term.isspace():
-    results = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).outerjoin(Show, Venue.id == Show.venue_id).all()
-    formatted_result = {
-          'count': len(results),
-          'data': []
-    }
-    now = datetime.datetime.now()
-    for venue in results:
-      upcoming_show = 0
-      for show in venue.show:
-        if show.artist:
-
-          # count for upcoming_show
-          if show.start_time > now:
-            upcoming_show = upcoming_show + 1
-      formatted_result['data'].append({
-                                      'id': venue.id,
-                                      'name': venue.name,
-                                      'num_upcoming_shows': upcoming_show})
+    try:
+      formatted_result = search_entities(Venue, search_term.strip())
+    except:
+      abort(500)
   response = formatted_result
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
+@app.route('/venues/nearby')
+@conditional()
+def nearby_venues_page():
+  # without coordinates the page only asks for them
+  results = None
+  location = (request.args.get('lat'), request.args.get('lon'), request.args.get('radius'))
+  if any(location):
+    try:
+      latitude, longitude, radius = parse_location(*location, app.config['NEARBY_DEFAULT_RADIUS_KM'],
+                                                   app.config['NEARBY_MAX_RADIUS_KM'])
+    except ValueError:
+      abort(400)
+    try:
+      results = nearby_venues(latitude, longitude, radius)
+    except:
+      abort(500)
+  return render_template('pages/nearby_venues.html', results=results, location=location,
+                         default_radius=app.config['NEARBY_DEFAULT_RADIUS_KM'])
+
 @app.route('/venues/<int:venue_id>')
+@conditional(venue_stamp)
 def show_venue(venue_id):
+  return cached_page('venue:{}'.format(venue_id), lambda: render_venue_page(venue_id))
+
+@app.route('/venues/<int:venue_id>/shows')
+@conditional(venue_stamp)
+def venue_shows(venue_id):
+  # further pages of show tiles for the "load more" buttons on the venue page
+  return render_show_tiles(Venue, venue_id)
+
+def render_venue_page(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
   '''
@@ -320,60 +1584,35 @@ def show_venue(venue_id):
 
   # Raise error if no venue_id
   try:
-    result = Venue.query.filter(Venue.id == venue_id).outerjoin(Show, Show.venue_id == Venue.id).all()
+    venue = Venue.query.options(selectinload(Venue.genres)).get(venue_id)
   except:
     abort(500)
   
-  if not result:
+  if venue is None:
     abort(404)
-  else:
-    formatted_result = {
-              'id': result[0].id,
-              'name': result[0].name,
-              'genres': result[0].genres.split(',') if result[0].genres else [],
-              'address': result[0].address,
-              'city': result[0].city,
-              'state': result[0].state,
-              'phone': result[0].phone,
-              'website': result[0].website,
-              'facebook_link': result[0].facebook_link,
-              'seeking_talent': result[0].seeking_talent,
-              'seeking_description': result[0].seeking_description,
-              'image_link': result[0].image_link,
-              'past_shows': [],
-              'upcoming_shows': [],
-              'past_shows_count': 0,
-              'upcoming_shows_count': 0
-    }
-    for show in result[0].show:
-      if show.artist:
-        now = datetime.datetime.now()
-        if show.start_time <= now:
-          formatted_result['past_shows'].append({
-                                'artist_id': show.artist.id,
-                                'artist_name': show.artist.name,
-                                'artist_image_link': show.artist.image_link,
-                                'start_time': str(show.start_time)
-          })
-        else:
-          formatted_result['upcoming_shows'].append({
-                                'artist_id': show.artist.id,
-                                'artist_name': show.artist.name,
-                                'artist_image_link': show.artist.image_link,
-                                'start_time': str(show.start_time)
-          })
-    formatted_result['past_shows_count'] = len(formatted_result['past_shows'])
-    formatted_result['upcoming_shows_count'] = len(formatted_result['upcoming_shows'])
+
+  # one bounded page each of upcoming and past shows, counts by aggregate
+  now = datetime.datetime.now()
+  try:
+    upcoming_shows, upcoming_cursor = entity_shows_page(Venue, venue_id, 'upcoming', now)
+    past_shows, past_cursor = entity_shows_page(Venue, venue_id, 'past', now)
+    upcoming_shows_count, past_shows_count = entity_show_counts(Venue, venue_id, now)
+  except:
+    abort(500)
 
   #data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
-  data = formatted_result
+  data = venue_page_data(venue, [genre.name for genre in venue.genres],
+                         (upcoming_shows, upcoming_cursor), (past_shows, past_cursor),
+                         (upcoming_shows_count, past_shows_count))
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
 @app.route('/venues/create', methods=['GET'])
+@conditional(cache_control='no-store')
 def create_venue_form():
+  from forms import VenueForm
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
@@ -395,9 +1634,11 @@ def create_venue_submission():
                   state = state,
                   address = address,
                   phone = phone,
-                  genres = ','.join(genres),
+                  genres = Genre.get_or_create(genres),
                   facebook_link = facebook_link)
     db.session.add(venue)
+    db.session.flush()
+    queue_geocode([venue.id])
     db.session.commit()
     # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
@@ -428,10 +1669,16 @@ def delete_venue(venue_id):
     try:
       name = venue[0].name
       print(name)
+      artist_ids = show_counterpart_ids(Venue, venue[0].id)
+      # the venue's own count goes with it, its artists' counts need adjusting
+      record_show_counts(db.session.query(Show.venue_id, Show.artist_id, Show.start_time)
+                                   .filter(Show.venue_id == venue[0].id), sign=-1)
+      record_series_counts(ShowSeries.query.filter(ShowSeries.venue_id == venue[0].id), sign=-1)
       db.session.delete(venue[0])
       db.session.commit()
     except:
       abort(500)
+    invalidate_pages(venue_ids=[venue[0].id], artist_ids=artist_ids)
   else:
     abort(404)
 
@@ -441,6 +1688,7 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional(lambda: listing_stamp('artist_listing'))
 def artists():
   # TODO: replace with real data returned from querying the database
   '''
@@ -456,14 +1704,14 @@ def artists():
   }]
   '''
   try:
-    results = Artist.query.all()
+    genre = request.args.get('genre')
+    live = artist_listing_query(genre)
+    results = live.all() if genre else listing_rows('artist_listing', artist_summary_query(), live)
   except:
     abort(500)
 
-  formatted_result = []
-  for artist in results:
-    formatted_result.append({'id': artist.id, 'name': artist.name})
-  data = formatted_result
+  data = [{'id': artist.id, 'name': artist.name, 'num_upcoming_shows': artist.num_upcoming_shows}
+          for artist in results]
   return render_template('pages/artists.html', artists=data)
 
 @app.route('/artists/search', methods=['POST'])
@@ -489,27 +1737,25 @@ def search_artists():
 
   # check for valid search_term
   if search_term and not search_term.isspace():
-    results = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).outerjoin(Show, Artist.id == Show.artist_id).all()
-    formatted_result = {
-          'count': len(results),
-          'data': []
-    }
-    now = datetime.datetime.now()
-    for artist in results:
-      upcoming_show = 0
-      for show in artist.show:
-        if show.venue:
-          if show.start_time > now:
-            upcoming_show = upcoming_show + 1
-      formatted_result['data'].append({
-                                      'id': artist.id,
-                                      'name': artist.name,
-                                      'num_upcoming_shows': upcoming_show})
+    try:
+      formatted_result = search_entities(Artist, search_term.strip())
+    except:
+      abort(500)
   response = formatted_result
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
+@conditional(artist_stamp)
 def show_artist(artist_id):
+  return cached_page('artist:{}'.format(artist_id), lambda: render_artist_page(artist_id))
+
+@app.route('/artists/<int:artist_id>/shows')
+@conditional(artist_stamp)
+def artist_shows(artist_id):
+  # further pages of show tiles for the "load more" buttons on the artist page
+  return render_show_tiles(Artist, artist_id)
+
+def render_artist_page(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
   '''
@@ -587,57 +1833,32 @@ def show_artist(artist_id):
   '''
 
   try:
-    result = Artist.query.filter(Artist.id == artist_id).outerjoin(Show, Show.artist_id == Artist.id).all()
+    artist = Artist.query.options(selectinload(Artist.genres)).get(artist_id)
   except:
     abort(500)
 
-  if not result:
+  if artist is None:
     abort(404)
-  else:
-    formatted_result = {
-              'id': result[0].id,
-              'name': result[0].name,
-              'genres': result[0].genres.split(',') if result[0].genres else [],
-              'city': result[0].city,
-              'state': result[0].state,
-              'phone': result[0].phone,
-              'website': result[0].website,
-              'facebook_link': result[0].facebook_link,
-              'seeking_venue': result[0].seeking_venue,
-              'seeking_description': result[0].seeking_description,
-              'image_link': result[0].image_link,
-              'past_shows': [],
-              'upcoming_shows': [],
-              'past_shows_count': 0,
-              'upcoming_shows_count': 0
-    }
-    for show in result[0].show:
-      if show.venue:
-        now = datetime.datetime.now()
-        if show.start_time <= now:
-          formatted_result['past_shows'].append({
-                                'venue_id': show.venue.id,
-                                'venue_name': show.venue.name,
-                                'venue_image_link': show.venue.image_link,
-                                'start_time': str(show.start_time)
-          })
-        else:
-          formatted_result['upcoming_shows'].append({
-                                'venue_id': show.venue.id,
-                                'venue_name': show.venue.name,
-                                'venue_image_link': show.venue.image_link,
-                                'start_time': str(show.start_time)
-          })
-    formatted_result['past_shows_count'] = len(formatted_result['past_shows'])
-    formatted_result['upcoming_shows_count'] = len(formatted_result['upcoming_shows'])
+
+  # one bounded page each of upcoming and past shows, counts by aggregate
+  now = datetime.datetime.now()
+  try:
+    upcoming_shows, upcoming_cursor = entity_shows_page(Artist, artist_id, 'upcoming', now)
+    past_shows, past_cursor = entity_shows_page(Artist, artist_id, 'past', now)
+    upcoming_shows_count, past_shows_count = entity_show_counts(Artist, artist_id, now)
+  except:
+    abort(500)
 
   #data = list(filter(lambda d: d['id'] == artist_id, [data1, data2, data3]))[0]
-  data = formatted_result
+  data = artist_page_data(artist, [genre.name for genre in artist.genres],
+                          (upcoming_shows, upcoming_cursor), (past_shows, past_cursor),
+                          (upcoming_shows_count, past_shows_count))
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@conditional(cache_control='no-store')
 def edit_artist(artist_id):
   '''
   artist={
@@ -657,7 +1878,7 @@ def edit_artist(artist_id):
   # TODO: populate form with fields from artist with ID <artist_id>
 
   try:
-    artist = Artist.query.filter(Artist.id == artist_id).all()[0]
+    artist = Artist.query.options(selectinload(Artist.genres)).filter(Artist.id == artist_id).all()[0]
   except:
     abort(500)
 
@@ -665,7 +1886,7 @@ def edit_artist(artist_id):
     formatted_result = {
           'id': artist.id,
           'name': artist.name,
-          'genres': artist.genres.split(',') if artist.genres else [],
+          'genres': [genre.name for genre in artist.genres],
           'city': artist.city,
           'state': artist.state,
           'phone': artist.phone,
@@ -679,6 +1900,7 @@ def edit_artist(artist_id):
     abort(404)
 
   # fill in the artist form
+  from forms import ArtistForm
   form = ArtistForm(name=formatted_result['name'], 
                     city=formatted_result['city'],
                     state=formatted_result['state'], 
@@ -703,7 +1925,7 @@ def edit_artist_submission(artist_id):
     artist.city = request.form['city']
     artist.state = request.form['state']
     artist.phone = request.form['phone']
-    artist.genres = ','.join(request.form.getlist('genres'))
+    artist.genres = Genre.get_or_create(request.form.getlist('genres'))
     artist.facebook_link = request.form['facebook_link']
   else:
     abort(404)
@@ -713,9 +1935,13 @@ def edit_artist_submission(artist_id):
   except:
     abort(500)
 
+  # venue pages list the artist's name and image next to its shows
+  invalidate_pages(artist_ids=[artist_id],
+                   venue_ids=show_counterpart_ids(Artist, artist_id))
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@conditional(cache_control='no-store')
 def edit_venue(venue_id):
   '''
   venue={
@@ -736,7 +1962,7 @@ def edit_venue(venue_id):
   # TODO: populate form with values from venue with ID <venue_id>
 
   try:
-    venue = Venue.query.filter(Venue.id == venue_id).all()[0]
+    venue = Venue.query.options(selectinload(Venue.genres)).filter(Venue.id == venue_id).all()[0]
   except:
     abort(500)
 
@@ -744,7 +1970,7 @@ def edit_venue(venue_id):
     formatted_result = {
           'id': venue.id,
           'name': venue.name,
-          'genres': venue.genres.split(',') if venue.genres else [],
+          'genres': [genre.name for genre in venue.genres],
           'address': venue.address,
           'city': venue.city,
           'state': venue.state,
@@ -759,6 +1985,7 @@ def edit_venue(venue_id):
     abort(404)
 
   # fill in the venue form
+  from forms import VenueForm
   form = VenueForm(name=formatted_result['name'],
                    city=formatted_result['city'],
                    state=formatted_result['state'],
@@ -782,11 +2009,16 @@ def edit_venue_submission(venue_id):
 
   if venue:
     venue.name = request.form['name']
+    if (venue.city, venue.state) != (request.form['city'], request.form['state']):
+      # the old coordinates are the old city's
+      for column, value in venue_location(None).items():
+        setattr(venue, column, value)
+      queue_geocode([venue_id])
     venue.city = request.form['city']
     venue.state = request.form['state']
     venue.address = request.form['address']
     venue.phone = request.form['phone']
-    venue.genres = ','.join(request.form.getlist('genres'))
+    venue.genres = Genre.get_or_create(request.form.getlist('genres'))
     venue.facebook_link = request.form['facebook_link']
   else:
     abort(404)
@@ -796,13 +2028,18 @@ def edit_venue_submission(venue_id):
   except:
     abort(500)
 
+  # artist pages list the venue's name and image next to its shows
+  invalidate_pages(venue_ids=[venue_id],
+                   artist_ids=show_counterpart_ids(Venue, venue_id))
   return redirect(url_for('show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
 @app.route('/artists/create', methods=['GET'])
+@conditional(cache_control='no-store')
 def create_artist_form():
+  from forms import ArtistForm
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
@@ -828,7 +2065,7 @@ def create_artist_submission():
                     city = city,
                     state = state,
                     phone = phone,
-                    genres = ','.join(genres),
+                    genres = Genre.get_or_create(genres),
                     facebook_link = facebook_link)
     db.session.add(artist)
     db.session.commit()
@@ -843,6 +2080,7 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional(lambda: listing_stamp('show_feed', timed=True))
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
@@ -886,77 +2124,454 @@ def shows():
   }]
   '''
 
+  # upcoming shows, one read of the show_feed summary (or one joined query)
+  # for the requested page, keyed on (start_time, id) so the cost of a page
+  # does not depend on how far into the listing it is
+  limit = app.config['SHOWS_PER_PAGE']
+  try:
+    bound = show_feed_bound(datetime.datetime.now(), request.args.get('after'))
+  except ValueError:
+    abort(400)
+
+  # series occurrences are merged in, expanded only as far as this page
   try:
-    shows = Show.query.all()
+    rows = listing_rows('show_feed', show_feed_query(bound, summary=True), show_feed_query(bound), limit + 1)
+    series = overlapping_series(series_listing_query(), bound, rows, limit)
   except:
     abort(500)
-
-  formatted_result = []
-  if shows:
-    for show in shows:
-      if show.venue_id and show.artist_id:
-        formatted_result.append({
-                  'venue_id': show.venue_id,
-                  'venue_name': show.venue.name,
-                  'artist_id': show.artist_id,
-                  'artist_name': show.artist.name,
-                  'artist_image_link': show.artist.image_link,
-                  'start_time': str(show.start_time)
-        })      
-  return render_template('pages/shows.html', shows=formatted_result)
+  formatted_result, next_cursor = show_listing_page(rows, series, bound)
+  return render_template('pages/shows.html', shows=formatted_result, next_cursor=next_cursor)
 
 @app.route('/shows/create')
+@conditional(cache_control='no-store')
 def create_shows():
   # renders form. do not touch.
+  from forms import ShowForm
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
+  from forms import ShowForm
+  form = ShowForm()
+  errors = {} if form.validate() else form.errors
+  if not errors:
+    errors = show_duration_errors(form.data) or show_reference_errors(form.data, *existing_show_references(
+      [form.venue_id.data], [form.artist_id.data]))
+  status = 400
+  if not errors:
+    booking = (form.venue_id.data, form.artist_id.data, form.start_time.data,
+               show_end_time(form.start_time.data, form.duration.data))
+    errors = conflict_errors(booking, booking_conflicts([booking])[0])
+    status = 409
+
+  if errors:
+    flash('An error occurred. Show could not be listed: ' +
+          ' '.join(message for messages in errors.values() for message in messages))
+    return render_template('forms/new_show.html', form=form), status
 
-  # on successful db insert, flash success
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Show could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
-  
-  artist_id = request.form['artist_id']
-  venue_id = request.form['venue_id']
-  start_time = request.form['start_time']
+  try:
+    db.session.add(Show(artist_id=form.artist_id.data, venue_id=form.venue_id.data,
+                        start_time=form.start_time.data, end_time=booking[3]))
+    record_show_counts([(form.venue_id.data, form.artist_id.data, form.start_time.data)])
+    db.session.commit()
+  except Exception as error:
+    db.session.rollback()
+    if is_booking_conflict(error):
+      flash('An error occurred. Show could not be listed: the venue or the artist was booked meanwhile')
+      return render_template('forms/new_show.html', form=form), 409
+    flash('An error occurred. Show could not be listed')
+    return render_template('forms/new_show.html', form=form), 500
+  invalidate_pages(venue_ids=[form.venue_id.data], artist_ids=[form.artist_id.data])
+  flash('Show was successfully listed!')
+  return render_template('pages/home.html')
+
+#  API
+#  ----------------------------------------------------------------
+
+API_FIELDS = {
+  Venue: ('id', 'name', 'city', 'state', 'address', 'phone', 'website', 'facebook_link',
+          'image_link', 'seeking_talent', 'seeking_description', 'latitude', 'longitude', 'genres'),
+  Artist: ('id', 'name', 'city', 'state', 'phone', 'website', 'facebook_link',
+           'image_link', 'seeking_venue', 'seeking_description', 'genres')
+}
+SHOW_API_FIELDS = ('id', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name',
+                   'artist_image_link')
+COUNT_API_FIELDS = ('upcoming_shows_count', 'past_shows_count')
+
+def api_error(status, message):
+  return jsonify({'error': message}), status
+
+def api_response(data, next_url=None):
+  return Response(dumps({'data': data, 'next': next_url}), mimetype='application/json')
+
+def api_stream(records):
+  return Response(stream_with_context(ndjson(records)), mimetype='application/x-ndjson')
+
+def api_next_url(after):
+  return url_for(request.endpoint, **dict(request.args.items(), **request.view_args, after=after))
+
+def api_entity_query(model, fields):
+  # only the requested columns; id is always selected for paging and genres
+  columns = [getattr(model, field) for field in fields
+             if field not in ('id', 'genres') + COUNT_API_FIELDS]
+  return db.session.query(model.id, *columns)
+
+def api_records(model, rows, fields):
+  # genres for the whole batch of rows come from one query
+  genres = genre_names(model, [row.id for row in rows]) if 'genres' in fields else {}
+  return [{field: genres.get(row.id, []) if field == 'genres' else getattr(row, field)
+           for field in fields} for row in rows]
+
+def api_list(model):
+  try:
+    fields = parse_fields(request.args.get('fields'), API_FIELDS[model])
+    limit = parse_limit(request.args.get('limit'), app.config['API_PAGE_SIZE'],
+                        app.config['API_MAX_PAGE_SIZE'])
+    after = int(request.args.get('after', 0))
+  except ValueError as e:
+    return api_error(400, str(e))
+
+  query = api_entity_query(model, fields).filter(model.id > after).order_by(model.id)
+  if request.args.get('genre'):
+    query = filter_by_genre(query, model, request.args['genre'])
+
+  if request.args.get('format') == 'ndjson':
+    # rows come from a server-side cursor and are serialized a chunk at a
+    # time, so an export never holds the whole table in memory
+    chunk_size = app.config['API_STREAM_CHUNK_SIZE']
+    rows = query.execution_options(stream_results=True).yield_per(chunk_size)
+    return api_stream(record for chunk in chunked(rows, chunk_size)
+                      for record in api_records(model, chunk, fields))
 
-  # check for valid inputs
   try:
-    artist_id = int(artist_id)
-    venue_id = int(venue_id)
-    start_time = datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
+    rows = query.limit(limit + 1).all()
+    records = api_records(model, rows[:limit], fields)
   except:
-    flash('An error occurred. Show could not be listed') 
+    abort(500)
+  next_url = api_next_url(rows[limit - 1].id) if len(rows) > limit else None
+  return api_response(records, next_url)
+
+def api_detail(model, entity_id):
+  try:
+    fields = parse_fields(request.args.get('fields'), API_FIELDS[model] + COUNT_API_FIELDS)
+  except ValueError as e:
+    return api_error(400, str(e))
 
-  # check if artist exists
   try:
-    artist = Artist.query.filter(Artist.id == artist_id).all()
+    row = api_entity_query(model, fields).filter(model.id == entity_id).first()
+    if row is None:
+      return api_error(404, 'Not found')
+    record = api_records(model, [row], [field for field in fields
+                                        if field not in COUNT_API_FIELDS])[0]
+    if set(COUNT_API_FIELDS) & set(fields):
+      counts = entity_show_counts(model, entity_id, datetime.datetime.now())
+      record.update((field, count) for field, count in zip(COUNT_API_FIELDS, counts)
+                    if field in fields)
   except:
     abort(500)
+  return Response(dumps({'data': record}), mimetype='application/json')
 
-  # check if venue exists
+def api_entity_shows(model, entity_id):
+  when = request.args.get('when', 'upcoming')
+  if when not in ('upcoming', 'past'):
+    return api_error(400, 'when must be upcoming or past')
   try:
-    venue = Venue.query.filter(Venue.id == venue_id).all()
+    if db.session.query(model.id).filter(model.id == entity_id).first() is None:
+      return api_error(404, 'Not found')
+    shows, next_cursor = entity_shows_page(model, entity_id, when, datetime.datetime.now(),
+                                           request.args.get('after'))
+  except ValueError:
+    return api_error(400, 'Malformed cursor')
+  return api_response(shows, api_next_url(next_cursor) if next_cursor else None)
+
+def api_availability(model, entity_id):
+  # ?from=2020-05-01&to=2020-05-08&min_minutes=60, by default the coming week
+  try:
+    start = parse_datetime(request.args['from'], 'from') if request.args.get('from') \
+            else datetime.datetime.now().replace(second=0, microsecond=0)
+    end = parse_datetime(request.args['to'], 'to') if request.args.get('to') \
+          else start + datetime.timedelta(days=7)
+    min_minutes = parse_minutes(request.args.get('min_minutes'), 'min_minutes')
+  except ValueError as e:
+    return api_error(400, str(e))
+  if not start < end <= start + datetime.timedelta(days=app.config['AVAILABILITY_MAX_DAYS']):
+    return api_error(400, 'to must be after from, by at most {} days'.format(app.config['AVAILABILITY_MAX_DAYS']))
+
+  try:
+    if db.session.query(model.id).filter(model.id == entity_id).first() is None:
+      return api_error(404, 'Not found')
+    busy = busy_intervals(model, entity_id, start, end)
   except:
     abort(500)
+  free = free_slots(busy, start, end, datetime.timedelta(minutes=min_minutes))
+  return Response(dumps({'data': {
+    'from': start,
+    'to': end,
+    'free': [{'start': slot_start, 'end': slot_end} for slot_start, slot_end in free],
+    'busy': [{'start': busy_start, 'end': busy_end} for busy_start, busy_end in busy],
+  }}), mimetype='application/json')
+
+def api_search(model):
+  search_term = request.args.get('q', '')
+  if not search_term or search_term.isspace():
+    return api_error(400, 'q is required')
+  try:
+    result = search_entities(model, search_term.strip())
+  except:
+    abort(500)
+  return Response(dumps(result), mimetype='application/json')
+
+@app.route('/api/v1/venues')
+@conditional()
+def api_venues():
+  return api_list(Venue)
+
+@app.route('/api/v1/venues/<int:venue_id>')
+@conditional(venue_stamp)
+def api_venue(venue_id):
+  return api_detail(Venue, venue_id)
+
+@app.route('/api/v1/venues/<int:venue_id>/shows')
+@conditional(venue_stamp)
+def api_venue_shows(venue_id):
+  return api_entity_shows(Venue, venue_id)
+
+@app.route('/api/v1/venues/<int:venue_id>/availability')
+@conditional(venue_stamp)
+def api_venue_availability(venue_id):
+  return api_availability(Venue, venue_id)
+
+@app.route('/api/v1/venues/<int:venue_id>/recommendations')
+@conditional()
+def api_venue_recommendations(venue_id):
+  try:
+    limit = parse_limit(request.args.get('limit'), app.config['RECOMMENDATIONS_LIMIT'],
+                        app.config['API_MAX_PAGE_SIZE'])
+  except ValueError as e:
+    return api_error(400, str(e))
+  try:
+    venue = db.session.query(Venue.id, Venue.city, Venue.state, Venue.seeking_talent) \
+                      .filter(Venue.id == venue_id).first()
+    if venue is None:
+      return api_error(404, 'Not found')
+    if not venue.seeking_talent:
+      return api_error(409, 'Venue {} is not seeking talent'.format(venue_id))
+    result = recommended_artists(venue, limit)
+  except:
+    abort(500)
+  return api_response(result)
+
+@app.route('/api/v1/venues/search')
+@conditional()
+def api_search_venues():
+  return api_search(Venue)
 
-  if artist and venue:
+@app.route('/api/v1/venues/nearby')
+@conditional()
+def api_nearby_venues():
+  try:
+    latitude, longitude, radius = parse_location(
+      request.args.get('lat'), request.args.get('lon'), request.args.get('radius'),
+      app.config['NEARBY_DEFAULT_RADIUS_KM'], app.config['NEARBY_MAX_RADIUS_KM'])
+  except ValueError as e:
+    return api_error(400, str(e))
+  try:
+    result = nearby_venues(latitude, longitude, radius)
+  except:
+    abort(500)
+  return Response(dumps(result), mimetype='application/json')
+
+@app.route('/api/v1/artists')
+@conditional()
+def api_artists():
+  return api_list(Artist)
+
+@app.route('/api/v1/artists/<int:artist_id>')
+@conditional(artist_stamp)
+def api_artist(artist_id):
+  return api_detail(Artist, artist_id)
+
+@app.route('/api/v1/artists/<int:artist_id>/shows')
+@conditional(artist_stamp)
+def api_artist_shows(artist_id):
+  return api_entity_shows(Artist, artist_id)
+
+@app.route('/api/v1/artists/<int:artist_id>/availability')
+@conditional(artist_stamp)
+def api_artist_availability(artist_id):
+  return api_availability(Artist, artist_id)
+
+@app.route('/api/v1/artists/search')
+@conditional()
+def api_search_artists():
+  return api_search(Artist)
+
+@app.route('/api/v1/shows')
+@conditional()
+def api_shows():
+  try:
+    fields = parse_fields(request.args.get('fields'), SHOW_API_FIELDS)
+    limit = parse_limit(request.args.get('limit'), app.config['API_PAGE_SIZE'],
+                        app.config['API_MAX_PAGE_SIZE'])
+    query = show_listing_query()
+    if request.args.get('after'):
+      query = after_show_cursor(query, request.args['after'])
+  except ValueError as e:
+    return api_error(400, str(e))
+
+  if request.args.get('format') == 'ndjson':
+    rows = query.execution_options(stream_results=True) \
+                .yield_per(app.config['API_STREAM_CHUNK_SIZE'])
+    return api_stream({field: getattr(row, field) for field in fields} for row in rows)
+
+  try:
+    rows = query.limit(limit + 1).all()
+  except:
+    abort(500)
+  next_url = api_next_url(show_cursor(rows[limit - 1])) if len(rows) > limit else None
+  return api_response([{field: getattr(row, field) for field in fields}
+                       for row in rows[:limit]], next_url)
+
+@app.route('/api/v1/shows/batch', methods=['POST'])
+def api_create_shows():
+  # {"shows": [{"venue_id": 1, "artist_id": 2, "start_time": "2020-05-21T21:30:00",
+  #             "duration": 90}, ...]}, durations in minutes being optional
+  # creates all the shows in one transaction, or none of them
+  body = request.get_json(silent=True)
+  if not isinstance(body, dict):
+    return api_error(400, 'Expected a JSON object')
+  shows = body.get('shows')
+  if not isinstance(shows, list) or not shows:
+    return api_error(400, 'Expected a JSON object with a non-empty "shows" list')
+  if len(shows) > app.config['API_MAX_BATCH_SIZE']:
+    return api_error(400, 'At most {} shows per batch'.format(app.config['API_MAX_BATCH_SIZE']))
+
+  from forms import ShowForm
+  validate = RowValidator(ShowForm)
+  records = []
+  errors = {}
+  for index, show in enumerate(shows):
+    if not isinstance(show, dict):
+      errors[index] = {'show': ['Expected an object.']}
+      continue
+    if isinstance(show.get('start_time'), str):
+      # ShowForm's format, with the ISO 8601 separator accepted too
+      show = dict(show, start_time=show['start_time'].replace('T', ' ', 1))
+    data, errors[index] = validate(show)
+    if data:
+      errors[index] = show_duration_errors(data)
+      records.append((index, {'venue_id': data['venue_id'], 'artist_id': data['artist_id'],
+                              'start_time': data['start_time'],
+                              'end_time': show_end_time(data['start_time'], data['duration'])}))
+  venue_ids, artist_ids = existing_show_references([record['venue_id'] for index, record in records],
+                                                   [record['artist_id'] for index, record in records])
+  for index, record in records:
+    errors[index] = errors[index] or show_reference_errors(record, venue_ids, artist_ids)
+  errors = {index: error for index, error in errors.items() if error}
+  if errors:
+    return Response(dumps({'error': 'Invalid shows, none were created', 'errors': errors}),
+                    status=400, mimetype='application/json')
+
+  # overlapping a booked show or series, or another show of the batch
+  bookings = [(record['venue_id'], record['artist_id'], record['start_time'], record['end_time'])
+              for index, record in records]
+  conflicts = booking_conflicts(bookings)
+  errors = {records[position][0]: conflict_errors(bookings[position], conflicts[position])
+            for position in sorted(conflicts)}
+  if errors:
+    return Response(dumps({'error': 'Shows overlap booked ones, none were created', 'errors': errors}),
+                    status=409, mimetype='application/json')
+
+  records = [record for index, record in records]
+  try:
+    db.session.execute(Show.__table__.insert(), records)
+    record_show_counts((record['venue_id'], record['artist_id'], record['start_time']) for record in records)
+    db.session.commit()
+  except Exception as error:
+    db.session.rollback()
+    if is_booking_conflict(error):
+      return api_error(409, 'Shows overlap ones booked meanwhile, none were created')
+    abort(500)
+  invalidate_pages(venue_ids=[record['venue_id'] for record in records],
+                   artist_ids=[record['artist_id'] for record in records])
+  return Response(dumps({'data': records}), status=201, mimetype='application/json')
+
+@app.route('/api/v1/series', methods=['POST'])
+def api_create_series():
+  # {"venue_id": 1, "artist_id": 2, "start_time": "2020-05-19T21:00:00",
+  #  "rule": "FREQ=WEEKLY;COUNT=52", "duration": 90}, start_time being the
+  # first occurrence and the duration (in minutes) optional
+  series = request.get_json(silent=True)
+  if not isinstance(series, dict):
+    return api_error(400, 'Expected a JSON object')
+  if isinstance(series.get('start_time'), str):
+    series = dict(series, start_time=series['start_time'].replace('T', ' ', 1))
+  from forms import ShowForm
+  data, errors = RowValidator(ShowForm)(series)
+  if data:
+    errors = show_duration_errors(data) or show_reference_errors(
+      data, *existing_show_references([data['venue_id']], [data['artist_id']]))
+  if data and not errors:
     try:
-      show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
-      db.session.add(show)
-      db.session.commit()
-      flash('Show was successfully listed!')
-    except:
-      flash('An error occurred. Show could not be listed') 
-  else:
-    abort(404)
+      last_start_time = last_occurrence(str(series.get('rule') or ''), data['start_time'])
+    except ValueError as e:
+      errors = {'rule': [str(e)]}
+  if errors:
+    return Response(dumps({'error': 'Invalid series', 'errors': errors}),
+                    status=400, mimetype='application/json')
+
+  record = {'venue_id': data['venue_id'], 'artist_id': data['artist_id'], 'rule': series['rule'],
+            'start_time': data['start_time'], 'last_start_time': last_start_time,
+            'duration': data['duration'] or app.config['SHOW_DEFAULT_DURATION_MINUTES']}
+  # every occurrence is checked, as stored shows are
+  length = datetime.timedelta(minutes=record['duration'])
+  bookings = [(record['venue_id'], record['artist_id'], occurrence, occurrence + length)
+              for occurrence in occurrences_from(record['rule'], record['start_time'])]
+  conflicts = booking_conflicts(bookings)
+  if conflicts:
+    messages = [message for position in sorted(conflicts)
+                for message in conflict_errors(bookings[position], conflicts[position])['start_time']]
+    return Response(dumps({'error': 'The series overlaps booked shows', 'errors': {'start_time': messages}}),
+                    status=409, mimetype='application/json')
+  try:
+    show_series = ShowSeries(**record)
+    db.session.add(show_series)
+    record_series_counts([show_series])
+    db.session.commit()
+    record['id'] = show_series.id
+  except:
+    db.session.rollback()
+    abort(500)
+  invalidate_pages(venue_ids=[record['venue_id']], artist_ids=[record['artist_id']])
+  return Response(dumps({'data': record}), status=201, mimetype='application/json')
+
+@app.route('/api/v1/series/<int:series_id>', methods=['DELETE'])
+def api_delete_series(series_id):
+  show_series = ShowSeries.query.get(series_id)
+  if show_series is None:
+    return api_error(404, 'Not found')
+  venue_id, artist_id = show_series.venue_id, show_series.artist_id
+  try:
+    record_series_counts([show_series], sign=-1)
+    db.session.delete(show_series)
+    db.session.commit()
+  except:
+    db.session.rollback()
+    abort(500)
+  invalidate_pages(venue_ids=[venue_id], artist_ids=[artist_id])
+  return '', 204
 
-  return render_template('pages/home.html')
+@app.route('/cache/stats')
+@conditional(cache_control='no-store')
+def cache_stats():
+  return jsonify(page_cache.stats())
+
+@app.route('/metrics')
+@conditional(cache_control='no-store')
+def metrics():
+  return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -977,6 +2592,358 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+def hot_queries():
+  # (name, query, index its plan is expected to use) for the queries behind
+  # the most visited pages
+  now = datetime.datetime.now()
+  page_size = app.config['SHOWS_PER_PAGE'] + 1
+  return [
+    ('shows page', show_feed_query((now, math.inf)).limit(page_size),
+     'ix_show_start_time_id'),
+    ('shows page after cursor', show_feed_query((now, 0)).limit(page_size),
+     'ix_show_start_time_id'),
+    ('shows page summary', fresh_listing('show_feed', show_feed_query((now, 0), summary=True), page_size),
+     'ix_show_feed_start_time_id'),
+    ('venues page', venue_listing_query(),
+     'ix_Venue_state_city'),
+    ('venues page summary', fresh_listing('venue_listing', venue_summary_query()),
+     'ix_venue_listing_state_city_id'),
+    ('venue page stamp', entity_stamp_query(Venue, 0),
+     'Venue_pkey' if db.engine.dialect.name == 'postgresql' else 'primary key'),
+    ('venue upcoming shows', entity_shows_query(Venue, 0, 'upcoming', now).limit(page_size),
+     'ix_show_venue_id_start_time'),
+    ('venue past shows', entity_shows_query(Venue, 0, 'past', now).limit(page_size),
+     'ix_show_venue_id_start_time'),
+    ('artist upcoming shows', entity_shows_query(Artist, 0, 'upcoming', now).limit(page_size),
+     'ix_show_artist_id_start_time'),
+    ('artist past shows', entity_shows_query(Artist, 0, 'past', now).limit(page_size),
+     'ix_show_artist_id_start_time'),
+    ('shows page series after cursor', series_listing_query().filter(ShowSeries.last_start_time >= now),
+     'ix_show_series_last_start_time'),
+    ('venue upcoming series', entity_series_query(Venue, 0).filter(ShowSeries.last_start_time >= now),
+     'ix_show_series_venue_id_last_start_time'),
+    ('artist upcoming series', entity_series_query(Artist, 0).filter(ShowSeries.last_start_time >= now),
+     'ix_show_series_artist_id_last_start_time'),
+    ('upcoming counts sweep',
+     db.session.query(Show.venue_id, Show.artist_id, func.count(Show.id))
+               .filter(Show.start_time > now, Show.start_time <= now)
+               .group_by(Show.venue_id, Show.artist_id),
+     'ix_show_start_time_id'),
+    ('job claim', db.session.query(Job.id).filter(jobs.claimable(now)).order_by(Job.run_at).limit(1),
+     'ix_job_run_at'),
+    ('venue overlap check', overlapping_shows_query(Show.venue_id, 0, now, now + longest_show()),
+     'ix_show_venue_id_start_time'),
+    ('artist overlap check', overlapping_shows_query(Show.artist_id, 0, now, now + longest_show()),
+     'ix_show_artist_id_start_time'),
+    ('venues nearby', nearby_venues_query(40.7, -74.0, app.config['NEARBY_DEFAULT_RADIUS_KM']),
+     'ix_Venue_location' if db.engine.dialect.name == 'postgresql' else 'ix_Venue_geohash'),
+  ]
+
+def explain(query):
+  # the database's plan for query, as text
+  connection = db.session.connection()
+  compiled = query.statement.compile(dialect=connection.dialect)
+  params = compiled.params
+  if compiled.positional:
+    params = tuple(params[name] for name in compiled.positiontup)
+  if connection.dialect.name == 'sqlite':
+    rows = connection.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return '\n'.join(row[-1] for row in rows)
+  if connection.dialect.name == 'postgresql':
+    # on small tables a sequential scan is cheaper, which says nothing
+    # about the plan the same query gets once the table has grown
+    connection.execute('SET LOCAL enable_seqscan = off')
+  rows = connection.execute('EXPLAIN ' + str(compiled), params)
+  return '\n'.join(row[0] for row in rows)
+
+@app.cli.command('explain-queries')
+def explain_queries():
+  """Check that the plans of the hot queries use their indexes."""
+  failed = False
+  for name, query, index in hot_queries():
+    plan = explain(query)
+    uses_index = index.lower() in plan.lower()
+    failed = failed or not uses_index
+    click.echo('{} {} (expects {})'.format('ok  ' if uses_index else 'FAIL', name, index))
+    click.echo('     ' + plan.replace('\n', '\n     '))
+  db.session.rollback()
+  if failed:
+    raise click.ClickException('Some hot queries do not use their indexes')
+
+@app.cli.command('sweep-counts')
+def sweep_counts():
+  """Age the shows that have started out of the upcoming show counts.
+
+  `flask worker` does this every UPCOMING_COUNT_SWEEP_INTERVAL seconds.
+  """
+  try:
+    started = sweep_upcoming_counts()
+    db.session.commit()
+  except Exception as error:
+    db.session.rollback()
+    raise click.ClickException('Sweep failed: {}'.format(error))
+  click.echo('{} shows started since the last sweep'.format(started))
+
+@app.cli.command('refresh-listings')
+@click.argument('names', nargs=-1, type=click.Choice(sorted(LISTING_SUMMARIES)))
+def refresh_listings(names):
+  """Refresh the summaries the listing pages read, by default all of them.
+
+  `flask worker` refreshes each every LISTING_REFRESH_INTERVAL seconds.
+  """
+  for name in names or sorted(LISTING_SUMMARIES):
+    started = time.perf_counter()
+    try:
+      refresh_listing(name)
+      db.session.commit()
+    except Exception as error:
+      db.session.rollback()
+      raise click.ClickException('Refreshing {} failed: {}'.format(name, error))
+    click.echo('{} refreshed in {:.0f} ms'.format(name, (time.perf_counter() - started) * 1000))
+
+@app.cli.command('reconcile-counts')
+@click.option('--repair', is_flag=True, help='Correct the counts found wrong.')
+def reconcile_counts(repair):
+  """Check the upcoming show counts against the shows and series.
+
+  Exits with status 1 when a count is wrong and --repair was not given.
+  """
+  drift = {}
+  for model in (Venue, Artist):
+    drift[model] = upcoming_count_drift(model)
+    for entity_id, stored, actual in drift[model][:20]:
+      click.echo('{} {}: stored {}, actual {}'.format(model.__name__, entity_id, stored, actual))
+    click.echo('{} {} counts wrong'.format(len(drift[model]), model.__name__.lower()))
+  if repair:
+    adjust_upcoming_counts(*({entity_id: actual - stored for entity_id, stored, actual in drift[model]}
+                             for model in (Venue, Artist)))
+    db.session.commit()
+    click.echo('Repaired')
+  else:
+    db.session.rollback()
+    if any(drift.values()):
+      sys.exit(1)
+
+@app.cli.command('worker')
+@click.option('--threads', type=int, help='Jobs run at once (default: JOBS_WORKER_THREADS).')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+def worker(threads, burst):
+  """Run background jobs: upcoming count updates and sweeps, page warm-ups,
+  listing summary refreshes."""
+  jobs.ensure_schedules()
+  stop = threading.Event()
+
+  def work(index):
+    with app.app_context():
+      jobs.work(worker_name(index), stop, burst)
+
+  pool = [threading.Thread(target=work, args=(index,), daemon=True)
+          for index in range(threads or app.config['JOBS_WORKER_THREADS'])]
+  for thread in pool:
+    thread.start()
+  try:
+    for thread in pool:
+      while thread.is_alive():
+        thread.join(1)
+  except KeyboardInterrupt:
+    click.echo('Stopping once the running jobs finish')
+    stop.set()
+    for thread in pool:
+      thread.join()
+
+# columns imported from the file as is, next to the form's fields
+IMPORT_EXTRA_COLUMNS = {
+  Venue: {'website': str, 'seeking_talent': parse_bool, 'seeking_description': str},
+  Artist: {'website': str, 'seeking_venue': parse_bool, 'seeking_description': str},
+}
+
+def import_location(row):
+  # (column values, form style errors) of an imported venue's latitude and
+  # longitude, which come together, within the bounds the nearby search
+  # takes, or not at all
+  values = [row.get(column) for column in ('latitude', 'longitude')]
+  if all(value in (None, '') for value in values):
+    return {}, {}
+  try:
+    latitude, longitude = (float(value) for value in values)
+  except (TypeError, ValueError):
+    return {}, {'latitude': ['Latitude and longitude must both be numbers.']}
+  if not in_range(latitude, longitude):
+    return {}, {'latitude': ['Latitude must be within -90 and 90, longitude within -180 and 180.']}
+  return venue_location((latitude, longitude)), {}
+
+def import_entities(model, rows, genres):
+  # ORM inserts, as each venue or artist needs its id for its genre rows;
+  # genres maps names to the Genre rows already looked up by this import
+  extra_columns = IMPORT_EXTRA_COLUMNS[model]
+  entities = []
+  rejected = []
+  for number, row, data in rows:
+    location, errors = import_location(row) if model is Venue else ({}, {})
+    if errors:
+      rejected.append((number, row, errors))
+      continue
+    names = data.pop('genres')
+    missing = [name for name in names if name not in genres]
+    genres.update(zip(missing, Genre.get_or_create(missing)))
+    data.update((column, parse(row[column]))
+                for column, parse in extra_columns.items() if row.get(column) not in (None, ''))
+    data.update(location)
+    entities.append(model(genres=[genres[name] for name in names], **data))
+  db.session.add_all(entities)
+  db.session.flush()
+  # new entities have no cached pages yet
+  return len(entities), rejected, {}
+
+def import_shows(rows, genres):
+  # references are checked for the whole batch in one query, then the rows
+  # go in with COPY on postgres and one executemany elsewhere
+  venue_ids, artist_ids = existing_show_references(
+    [data['venue_id'] for number, row, data in rows], [data['artist_id'] for number, row, data in rows])
+  accepted = []
+  rejected = []
+  for number, row, data in rows:
+    errors = show_duration_errors(data) or show_reference_errors(data, venue_ids, artist_ids)
+    if errors:
+      rejected.append((number, row, errors))
+    else:
+      accepted.append((number, row, {'venue_id': data['venue_id'], 'artist_id': data['artist_id'],
+                                     'start_time': data['start_time'],
+                                     'end_time': show_end_time(data['start_time'], data['duration'])}))
+  # rows overlapping booked shows or each other are rejected, all of the
+  # rows of an overlapping pair within the batch
+  conflicts = booking_conflicts([(record['venue_id'], record['artist_id'], record['start_time'], record['end_time'])
+                                 for number, row, record in accepted]) if accepted else {}
+  records = []
+  for position, (number, row, record) in enumerate(accepted):
+    if position in conflicts:
+      rejected.append((number, row, conflict_errors(
+        (record['venue_id'], record['artist_id'], record['start_time'], record['end_time']), conflicts[position])))
+    else:
+      records.append(record)
+  rejected.sort(key=lambda item: item[0])
+  connection = db.session.connection()
+  if records and connection.dialect.name == 'postgresql':
+    copy_rows(connection, Show.__table__, ('venue_id', 'artist_id', 'start_time', 'end_time'), records)
+  elif records:
+    connection.execute(Show.__table__.insert(), records)
+  record_show_counts((record['venue_id'], record['artist_id'], record['start_time']) for record in records)
+  touched = {'venue_ids': [record['venue_id'] for record in records],
+             'artist_ids': [record['artist_id'] for record in records]}
+  return len(records), rejected, touched
+
+# form classes by name, forms.py being imported when the command runs
+IMPORTS = {
+  'venues': ('VenueForm', partial(import_entities, Venue)),
+  'artists': ('ArtistForm', partial(import_entities, Artist)),
+  'shows': ('ShowForm', import_shows),
+}
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['csv', 'ndjson']),
+              help='File format, by default taken from the extension.')
+@click.option('--batch-size', type=int, help='Rows per transaction (default: IMPORT_BATCH_SIZE).')
+@click.option('--checkpoint', 'checkpoint_path', help='Progress file (default: PATH.checkpoint).')
+@click.option('--restart', is_flag=True, help='Discard the checkpoint and start from the first row.')
+@click.option('--rejects', type=click.File('a'), help='Append rejected rows and their errors to this NDJSON file.')
+def import_rows(kind, path, format, batch_size, checkpoint_path, restart, rejects):
+  """Import venues, artists or shows from a CSV or NDJSON file.
+
+  Rows are validated with the same forms as the web pages and inserted in
+  batches, each committed on its own. An interrupted import resumes after the
+  last committed batch when run again.
+  """
+  import forms
+  form_name, insert = IMPORTS[kind]
+  validate = RowValidator(getattr(forms, form_name))
+  checkpoint = Checkpoint(checkpoint_path or path + '.checkpoint', path, kind)
+  if restart:
+    checkpoint.clear()
+  try:
+    checkpoint.load()
+  except ValueError as error:
+    raise click.ClickException(str(error))
+  if checkpoint.done:
+    click.echo('Resuming after row {}'.format(checkpoint.done))
+
+  def reject(number, row, errors):
+    checkpoint.rejected += 1
+    if rejects:
+      rejects.write(dumps({'row_number': number, 'row': row, 'errors': errors}) + '\n')
+    elif checkpoint.rejected <= 10:
+      click.echo('row {}: {}'.format(number, errors), err=True)
+
+  genres = {}
+  read = 0
+  started = time.perf_counter()
+  batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+  for batch in chunked(read_rows(path, format, skip=checkpoint.done), batch_size):
+    valid = []
+    for number, row in batch:
+      data, errors = validate(row)
+      if errors:
+        reject(number, row, errors)
+      else:
+        valid.append((number, row, data))
+    try:
+      inserted, rejected, touched = insert(valid, genres) if valid else (0, [], {})
+      db.session.commit()
+    except Exception as error:
+      db.session.rollback()
+      raise click.ClickException('Batch ending at row {} failed, nothing after row {} was imported: {}'
+                                 .format(batch[-1][0], checkpoint.done, error))
+    invalidate_pages(**touched)
+    for number, row, errors in rejected:
+      reject(number, row, errors)
+    read += len(batch)
+    checkpoint.done = batch[-1][0]
+    checkpoint.inserted += inserted
+    checkpoint.save()
+    click.echo('{} rows read, {} imported, {} rejected ({:.0f} rows/s)'.format(
+      checkpoint.done, checkpoint.inserted, checkpoint.rejected,
+      read / max(time.perf_counter() - started, 1e-9)))
+  click.echo('Done: {} {} imported, {} rows rejected'.format(checkpoint.inserted, kind, checkpoint.rejected))
+
+@app.cli.command('geocode')
+@click.argument('gazetteer_path', required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option('--all', 'everything', is_flag=True, help='Place venues that already have coordinates again.')
+def geocode(gazetteer_path, everything):
+  """Place venues at their city's coordinates from a gazetteer.
+
+  GAZETTEER_PATH is a GeoNames dump such as cities500.txt, by default the
+  GAZETTEER_PATH setting. Venues are matched on city and state (admin1
+  code); by default only those without coordinates are looked up.
+  """
+  path = gazetteer_path or app.config['GAZETTEER_PATH']
+  if not path:
+    raise click.UsageError('Give a gazetteer file or set GAZETTEER_PATH.')
+  started = time.perf_counter()
+  gazetteer = Gazetteer.load(path)
+  click.echo('{} places loaded in {:.1f}s'.format(len(gazetteer), time.perf_counter() - started))
+
+  query = db.session.query(Venue.id, Venue.city, Venue.state).order_by(Venue.id)
+  if not everything:
+    query = query.filter(Venue.geohash.is_(None))
+  after = 0
+  located = missed = 0
+  batch_size = app.config['IMPORT_BATCH_SIZE']
+  while True:
+    venues = query.filter(Venue.id > after).limit(batch_size).all()
+    if not venues:
+      break
+    placed = locate_venues(gazetteer, venues)
+    db.session.commit()
+    located += placed
+    missed += len(venues) - placed
+    after = venues[-1].id
+  click.echo('{} venues placed, {} not found in the gazetteer'.format(located, missed))
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
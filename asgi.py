@@ -0,0 +1,258 @@
+"""ASGI entry point serving the read-heavy pages as coroutines.
+
+    uvicorn asgi:application --workers 4
+
+The venue, artist and show listings and the venue and artist pages run on
+an async driver (asyncpg for Postgres, aiosqlite for SQLite) through the
+``databases`` package. They execute the queries app.py builds and render
+the same templates with the same page data, so a worker keeps many slow
+clients waiting on the database at once instead of one per thread. Every
+other route goes to the Flask app through Starlette's WSGI middleware,
+which runs it in a thread pool. So do requests those pages leave to Flask:
+sessions with flashed messages or pinned to the primary after a write, and
+pages Flask answers with an error.
+
+Like gunicorn.conf.py for wsgi.py, importing this module defaults
+FYYUR_ENV to production and FYYUR_CLI_MIGRATIONS to false.
+
+Needs the starlette, uvicorn, databases and asyncpg packages of
+requirements.txt; serving a SQLite database needs aiosqlite instead of
+asyncpg.
+"""
+
+import asyncio
+import datetime
+import os
+import time
+
+# the production profile, without the `flask db` commands, unless set
+os.environ.setdefault('FYYUR_ENV', 'production')
+os.environ.setdefault('FYYUR_CLI_MIGRATIONS', 'false')
+
+from databases import Database
+from flask import render_template, session
+from sqlalchemy.engine.url import make_url
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response
+from starlette.routing import Mount, Route
+
+from app import (
+    app, db, page_cache, Venue, Artist, Record, venue_listing_query, artist_listing_query,
+    venue_summary_query, artist_summary_query, fresh_listing, show_feed_bound, show_feed_query,
+    series_listing_query, listing_stamp_query, entity_stamp_query, with_time_bucket,
+    overlapping_series_query, entity_shows_query, entity_series_query, entity_shows_bound,
+    entity_show_tiles, entity_show_counts_queries, with_series_counts, genre_names_query,
+    venue_areas, venue_page_data, artist_page_data, show_listing_page,
+)
+from http_cache import cache_headers, is_modified, page_version
+from profiling import request_duration
+
+
+def async_database(config):
+    url = make_url(config['ASYNC_DATABASE_URL'] or config['SQLALCHEMY_DATABASE_URI'])
+    # databases picks its driver from the bare dialect name
+    url.drivername = url.get_backend_name()
+    options = {}
+    if url.drivername.startswith('postgres'):
+        options['min_size'] = 1
+        options['max_size'] = config['ASYNC_DATABASE_POOL_SIZE']
+        if config['DATABASE_STATEMENT_TIMEOUT']:
+            options['server_settings'] = {'statement_timeout': str(config['DATABASE_STATEMENT_TIMEOUT'])}
+    return Database(str(url), **options)
+
+
+database = async_database(app.config)
+flask_app = WSGIMiddleware(app)
+
+
+class Fallback(Exception):
+    """Raised by a page to have the Flask app answer the request instead."""
+
+
+async def fetch(query):
+    # the rows of an ORM query, built with db.session but executed here
+    return [Record(row.items()) for row in await database.fetch_all(query.statement)]
+
+
+def request_context(request):
+    # Flask's request context for render_template and the session; pushed
+    # and popped without an await in between, so it is this request's alone
+    return app.test_request_context(request.url.path, base_url=str(request.base_url),
+                                    query_string=request.url.query,
+                                    headers=list(request.headers.items()))
+
+
+def render(request, template, **context):
+    with request_context(request):
+        return render_template(template, **context)
+
+
+def plain_request(request):
+    # flashes pop from the session, which only Flask saves back, and pinned
+    # sessions read from the primary through Flask
+    with request_context(request):
+        return '_flashes' not in session and session.get('primary_until', 0) <= time.time()
+
+
+class Page(object):
+    """ASGI app running handler for GET and HEAD, and the Flask view for the
+    other methods of its route.
+
+    Handlers are named after the Flask endpoints they stand in for, which
+    label their request metrics. stamp, as the stamps of http_cache.py but a
+    coroutine taking the request, gives the page's validators, and a client
+    whose copy is current is answered 304 before handler runs.
+    """
+
+    def __init__(self, handler, stamp=None):
+        self.handler = handler
+        self.stamp = stamp
+
+    async def __call__(self, scope, receive, send):
+        request = Request(scope, receive)
+        started = time.perf_counter()
+        try:
+            if request.method not in ('GET', 'HEAD') or not plain_request(request):
+                raise Fallback()
+            version = page_version(app)
+            modified = await self.stamp(request) if self.stamp else None
+            if modified is not None and not is_modified(modified, version,
+                                                        request.headers.get('if-none-match'),
+                                                        request.headers.get('if-modified-since')):
+                response = Response(status_code=304)
+            else:
+                response = await self.handler(request)
+            if response.status_code in (200, 304):
+                response.headers.update(cache_headers(modified, version, app.config['HTTP_CACHE_CONTROL']))
+            request_duration.observe(time.perf_counter() - started,
+                                     endpoint=self.handler.__name__, method=request.method)
+        except Fallback:
+            response = flask_app
+        await response(scope, receive, send)
+
+
+async def query_stamp(query):
+    rows = await fetch(query)
+    return rows[0].stamp if rows else None
+
+
+def listing_stamp(name, timed=False):
+    # as app.listing_stamp; pinned sessions never get here
+    async def stamp(request):
+        if request.query_params.get('genre'):
+            return None
+        modified = await query_stamp(listing_stamp_query(name))
+        return with_time_bucket(modified) if timed else modified
+    return stamp
+
+
+def entity_stamp(model):
+    async def stamp(request):
+        return with_time_bucket(await query_stamp(
+            entity_stamp_query(model, request.path_params['entity_id'])))
+    return stamp
+
+
+async def listing_rows(name, summary, live, limit=None):
+    # as app.listing_rows; sessions pinned to the primary go to Flask anyway
+    rows = await fetch(fresh_listing(name, summary, limit))
+    return rows or await fetch(live.limit(limit) if limit else live)
+
+
+async def venues(request):
+    genre = request.query_params.get('genre')
+    live = venue_listing_query(genre)
+    rows = await fetch(live) if genre else await listing_rows('venue_listing', venue_summary_query(), live)
+    return HTMLResponse(render(request, 'pages/venues.html', areas=venue_areas(rows)))
+
+
+async def artists(request):
+    genre = request.query_params.get('genre')
+    live = artist_listing_query(genre)
+    rows = await fetch(live) if genre else await listing_rows('artist_listing', artist_summary_query(), live)
+    data = [{'id': artist.id, 'name': artist.name, 'num_upcoming_shows': artist.num_upcoming_shows}
+            for artist in rows]
+    return HTMLResponse(render(request, 'pages/artists.html', artists=data))
+
+
+async def shows(request):
+    limit = app.config['SHOWS_PER_PAGE']
+    try:
+        bound = show_feed_bound(datetime.datetime.now(), request.query_params.get('after'))
+    except ValueError:
+        raise Fallback()
+    rows = await listing_rows('show_feed', show_feed_query(bound, summary=True), show_feed_query(bound),
+                              limit + 1)
+    series = await fetch(overlapping_series_query(series_listing_query(), bound, rows, limit))
+    formatted_result, next_cursor = show_listing_page(rows, series, bound)
+    return HTMLResponse(render(request, 'pages/shows.html', shows=formatted_result,
+                               next_cursor=next_cursor))
+
+
+async def entity_shows_page(model, entity_id, when, now):
+    limit = app.config['DETAIL_SHOWS_LIMIT']
+    rows = await fetch(entity_shows_query(model, entity_id, when, now).limit(limit + 1))
+    bound, descending = entity_shows_bound(when, now)
+    series = await fetch(overlapping_series_query(entity_series_query(model, entity_id),
+                                                  bound, rows, limit, descending))
+    return entity_show_tiles(model, rows, series, bound, descending)
+
+
+async def entity_show_counts(model, entity_id, now):
+    counts, series = entity_show_counts_queries(model, entity_id, now)
+    counts, series = await asyncio.gather(fetch(counts), fetch(series))
+    return with_series_counts((counts[0].upcoming, counts[0].past), series, now)
+
+
+async def entity_page(request, model, template, page_data):
+    # the queries of the page run concurrently, on as many connections
+    entity_id = request.path_params['entity_id']
+    key = '{}:{}'.format(model.__name__.lower(), entity_id)
+    # the Redis backends block on the network, so off the event loop
+    cached = await run_in_threadpool(page_cache.get, key)
+    if cached is not None:
+        return HTMLResponse(cached)
+    now = datetime.datetime.now()
+    entity, genres, upcoming, past, counts = await asyncio.gather(
+        fetch(db.session.query(model).filter(model.id == entity_id)),
+        fetch(genre_names_query(model, [entity_id])),
+        entity_shows_page(model, entity_id, 'upcoming', now),
+        entity_shows_page(model, entity_id, 'past', now),
+        entity_show_counts(model, entity_id, now))
+    if not entity:
+        raise Fallback()
+    data = page_data(entity[0], [row.name for row in genres], upcoming, past, counts)
+    rendered = render(request, template, **{model.__name__.lower(): data})
+    await run_in_threadpool(page_cache.set, key, rendered)
+    return HTMLResponse(rendered)
+
+
+async def show_venue(request):
+    return await entity_page(request, Venue, 'pages/show_venue.html', venue_page_data)
+
+
+async def show_artist(request):
+    return await entity_page(request, Artist, 'pages/show_artist.html', artist_page_data)
+
+
+async def server_error(request, exc):
+    app.logger.error('Error serving %s', request.url.path, exc_info=exc)
+    return HTMLResponse(render(request, 'errors/500.html'), status_code=500)
+
+
+application = Starlette(
+    routes=[
+        Route('/venues', Page(venues, listing_stamp('venue_listing'))),
+        Route('/venues/{entity_id:int}', Page(show_venue, entity_stamp(Venue))),
+        Route('/artists', Page(artists, listing_stamp('artist_listing'))),
+        Route('/artists/{entity_id:int}', Page(show_artist, entity_stamp(Artist))),
+        Route('/shows', Page(shows, listing_stamp('show_feed', timed=True))),
+        Mount('/', flask_app),
+    ],
+    exception_handlers={500: server_error},
+    on_startup=[database.connect],
+    on_shutdown=[database.disconnect],
+)
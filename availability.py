@@ -0,0 +1,66 @@
+"""Busy intervals of venues and artists: overlaps and free slots.
+
+Intervals are half-open ``(start, end)`` pairs, so a show ending at 22:00
+leaves the slot free for one starting at 22:00. The database side of the
+conflict checks lives in app.py: a show may only overlap shows starting
+less than the longest allowed show before it, so the stored shows to
+check are one short range of the (venue_id, start_time) and (artist_id,
+start_time) indexes, whatever the length of the history behind them.
+"""
+
+import heapq
+from collections import defaultdict
+
+
+def overlaps(first, second):
+    return first[0] < second[1] and second[0] < first[1]
+
+
+def overlapping_pairs(intervals):
+    """Pairs of positions of the (key, start, end) intervals that share a
+    key and overlap, found with one sweep per key (O(n log n + pairs))."""
+    by_key = defaultdict(list)
+    for position, (key, start, end) in enumerate(intervals):
+        by_key[key].append((start, end, position))
+    pairs = []
+    for group in by_key.values():
+        group.sort()
+        # (end, position) of the intervals still open at the current start
+        active = []
+        for start, end, position in group:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            pairs.extend((other, position) for other_end, other in active)
+            heapq.heappush(active, (end, position))
+    return pairs
+
+
+def merge(intervals):
+    """The union of the intervals, as sorted disjoint intervals."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def free_slots(busy, start, end, min_length=None):
+    """The gaps of at least min_length (a timedelta) between start and end
+    not covered by the busy intervals."""
+    slots = []
+    cursor = start
+    for busy_start, busy_end in merge(busy):
+        if busy_end <= cursor:
+            continue
+        if busy_start >= end:
+            break
+        if busy_start > cursor:
+            slots.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if cursor < end:
+        slots.append((cursor, end))
+    if min_length:
+        slots = [slot for slot in slots if slot[1] - slot[0] >= min_length]
+    return slots
@@ -0,0 +1,395 @@
+"""Benchmark every route of app.py against a synthetic dataset.
+
+Generate a dataset, then time the routes through the Flask test client:
+
+    python bench.py generate --database sqlite:////tmp/fyyur-bench.db \\
+        --venues 10000 --artists 100000 --shows 5000000
+    python bench.py run --database sqlite:////tmp/fyyur-bench.db --output before.json
+    python bench.py compare before.json after.json
+
+``run`` reports p50/p95/p99 latency, SQL statements per request and the peak
+Python memory allocated by one request of each route, and saves them as JSON
+together with the commit and dataset they were measured on. ``compare``
+prints the change in p95 latency between two such files and exits with
+status 1 when a route slowed down by more than --threshold percent.
+
+The database is dropped and recreated by ``generate``; point it at a
+throwaway SQLite file or Postgres database, never at real data.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+          'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+          'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other']
+CITIES = [('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'), ('Austin', 'TX'),
+          ('Chicago', 'IL'), ('Seattle', 'WA'), ('Nashville', 'TN'), ('New Orleans', 'LA'),
+          ('Denver', 'CO'), ('Boston', 'MA'), ('Portland', 'OR'), ('Atlanta', 'GA')]
+CITY_CENTRES = {'San Francisco': (37.77, -122.42), 'Los Angeles': (34.05, -118.24),
+                'New York': (40.71, -74.01), 'Austin': (30.27, -97.74), 'Chicago': (41.88, -87.63),
+                'Seattle': (47.61, -122.33), 'Nashville': (36.16, -86.78), 'New Orleans': (29.95, -90.07),
+                'Denver': (39.74, -104.99), 'Boston': (42.36, -71.06), 'Portland': (45.52, -122.68),
+                'Atlanta': (33.75, -84.39)}
+WORDS = ['Velvet', 'Hop', 'Lounge', 'Sax', 'Band', 'Petals', 'Guns', 'Wild', 'Blue', 'Note',
+         'Park', 'Square', 'Musical', 'Dueling', 'Pianos', 'Hall', 'Echo', 'Static', 'Neon',
+         'Harbor', 'Station', 'Garden', 'Cellar', 'Rooftop', 'Quartet', 'Collective']
+
+VENUE_FORM = {'name': 'Bench Venue', 'city': 'Austin', 'state': 'TX', 'address': '1 Main St',
+              'phone': '512-555-0100', 'genres': ['Jazz', 'Blues'], 'image_link': '',
+              'facebook_link': 'https://www.facebook.com/benchvenue', 'website': '',
+              'seeking_description': ''}
+ARTIST_FORM = dict(VENUE_FORM, name='Bench Artist')
+
+
+def load_app(database, cold_cache=False):
+    # configuration is read when app is imported
+    os.environ['DATABASE_URL'] = database
+    os.environ.setdefault('FYYUR_ENV', 'testing')
+    os.environ.setdefault('CACHE_BACKEND', 'memory')
+    import app
+    if cold_cache:
+        app.page_cache.ttl = 0
+    return app
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def insert_rows(connection, table, rows, batch_size):
+    from api import chunked
+    from importer import copy_rows
+    for chunk in chunked(rows, batch_size):
+        if connection.dialect.name == 'postgresql':
+            # columns left out take their server defaults
+            copy_rows(connection, table, list(chunk[0]), chunk)
+        else:
+            connection.execute(table.insert(), chunk)
+
+
+def generate(args):
+    m = load_app(args.database)
+    rng = random.Random(args.seed)
+    now = datetime.datetime.now().replace(microsecond=0)
+    span = int(datetime.timedelta(days=730).total_seconds())
+
+    def entities(count, seeking):
+        for entity_id in range(1, count + 1):
+            city, state = rng.choice(CITIES)
+            yield {'id': entity_id, 'name': words(rng, 3), 'city': city, 'state': state,
+                   'phone': '555-{:03d}-{:04d}'.format(rng.randrange(1000), rng.randrange(10000)),
+                   'image_link': 'https://images.example.com/{}.jpg'.format(entity_id),
+                   'facebook_link': 'https://www.facebook.com/{}'.format(entity_id),
+                   seeking: rng.random() < 0.3}
+
+    def venues():
+        for row in entities(args.venues, 'seeking_talent'):
+            row['address'] = '{} {} St'.format(rng.randrange(1, 2000), rng.choice(WORDS))
+            # spread over about 10 km around the city centre
+            latitude, longitude = CITY_CENTRES[row['city']]
+            row.update(m.venue_location((latitude + rng.gauss(0, 0.1), longitude + rng.gauss(0, 0.1))))
+            yield row
+
+    def entity_genres(key, count):
+        for entity_id in range(1, count + 1):
+            for genre_id in rng.sample(range(1, len(GENRES) + 1), rng.randint(1, 3)):
+                yield {key: entity_id, 'genre_id': genre_id}
+
+    def shows():
+        # not checked for overlaps, which the generated data has some of
+        for show_id in range(1, args.shows + 1):
+            start_time = now + datetime.timedelta(seconds=rng.randrange(-span, span) // 1800 * 1800)
+            yield {'id': show_id, 'venue_id': rng.randint(1, args.venues),
+                   'artist_id': rng.randint(1, args.artists), 'start_time': start_time,
+                   'end_time': m.show_end_time(start_time, rng.choice((60, 90, 120, 180)))}
+
+    def series():
+        for series_id in range(1, args.series + 1):
+            start_time = now + datetime.timedelta(days=rng.randrange(-365, 365), hours=rng.randrange(24))
+            rule = 'FREQ=WEEKLY;COUNT={}'.format(rng.randint(4, 52))
+            yield {'id': series_id, 'venue_id': rng.randint(1, args.venues),
+                   'artist_id': rng.randint(1, args.artists), 'rule': rule, 'start_time': start_time,
+                   'last_start_time': m.last_occurrence(rule, start_time)}
+
+    started = time.perf_counter()
+    with m.app.app_context():
+        engine = m.db.engine
+        if engine.dialect.name == 'postgresql':
+            engine.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        m.db.drop_all()
+        m.db.create_all()
+        tables = [
+            (m.Genre.__table__, ({'id': i, 'name': name} for i, name in enumerate(GENRES, 1))),
+            (m.Venue.__table__, venues()),
+            (m.Artist.__table__, entities(args.artists, 'seeking_venue')),
+            (m.venue_genres, entity_genres('venue_id', args.venues)),
+            (m.artist_genres, entity_genres('artist_id', args.artists)),
+            (m.Show.__table__, shows()),
+            (m.ShowSeries.__table__, series()),
+        ]
+        for table, rows in tables:
+            with engine.begin() as connection:
+                insert_rows(connection, table, rows, args.batch_size)
+                if connection.dialect.name == 'postgresql' and 'id' in table.c:
+                    # ids were given explicitly, so move the sequences past them
+                    connection.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                                       "coalesce(max(id), 1)) FROM {0}".format(
+                                           connection.dialect.identifier_preparer.format_table(table)))
+            print('{:>14} {:>8.1f}s'.format(table.name, time.perf_counter() - started))
+        # the rows went in around the write paths that keep the upcoming
+        # show counts, so the counts start from a reconciliation
+        m.adjust_upcoming_counts(*({entity_id: actual - stored
+                                    for entity_id, stored, actual in m.upcoming_count_drift(model)}
+                                   for model in (m.Venue, m.Artist)))
+        m.db.session.commit()
+        print('{:>14} {:>8.1f}s'.format('counts', time.perf_counter() - started))
+        if engine.dialect.name == 'postgresql':
+            engine.execute('ANALYZE')
+
+
+def percentile(values, p):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(p / 100.0 * len(ordered))) - 1, 0)]
+
+
+def scenarios(m, rng, scale, disposable):
+    # (name, method, function returning the path and test client keywords)
+    venue = lambda: rng.randint(1, scale['venues'])
+    artist = lambda: rng.randint(1, scale['artists'])
+    show_time = lambda: (datetime.datetime.now() + datetime.timedelta(days=rng.randint(-700, 700)))
+    cursor = lambda: m.show_cursor(m.Show(id=0, start_time=show_time().replace(microsecond=0)))
+    genre = lambda: rng.choice(GENRES)
+    term = lambda: rng.choice(WORDS).lower()[:4]
+    near = lambda: 'lat={:.4f}&lon={:.4f}&radius={}'.format(
+        *CITY_CENTRES[rng.choice(CITIES)[0]], rng.choice((2, 10, 50)))
+    show = lambda: {'venue_id': venue(), 'artist_id': artist(),
+                    'start_time': show_time().strftime('%Y-%m-%d %H:%M:%S')}
+    get = lambda path: lambda: (path(), {})
+    return [
+        ('home', 'GET', get(lambda: '/')),
+        ('venues', 'GET', get(lambda: '/venues')),
+        ('venues by genre', 'GET', get(lambda: '/venues?genre=' + genre())),
+        ('venue', 'GET', get(lambda: '/venues/{}'.format(venue()))),
+        ('venue past shows', 'GET', get(lambda: '/venues/{}/shows?when=past'.format(venue()))),
+        ('venue search', 'POST', lambda: ('/venues/search', {'data': {'search_term': term()}})),
+        ('venues nearby', 'GET', get(lambda: '/venues/nearby?' + near())),
+        ('venue create form', 'GET', get(lambda: '/venues/create')),
+        ('venue create', 'POST', lambda: ('/venues/create', {'data': VENUE_FORM})),
+        ('venue edit form', 'GET', get(lambda: '/venues/{}/edit'.format(venue()))),
+        ('venue edit', 'POST', lambda: ('/venues/{}/edit'.format(venue()), {'data': VENUE_FORM})),
+        ('venue delete', 'DELETE', lambda: ('/venues/{}'.format(next(disposable['venues'])), {})),
+        ('artists', 'GET', get(lambda: '/artists')),
+        ('artists by genre', 'GET', get(lambda: '/artists?genre=' + genre())),
+        ('artist', 'GET', get(lambda: '/artists/{}'.format(artist()))),
+        ('artist upcoming shows', 'GET', get(lambda: '/artists/{}/shows?when=upcoming'.format(artist()))),
+        ('artist search', 'POST', lambda: ('/artists/search', {'data': {'search_term': term()}})),
+        ('artist create form', 'GET', get(lambda: '/artists/create')),
+        ('artist create', 'POST', lambda: ('/artists/create', {'data': ARTIST_FORM})),
+        ('artist edit form', 'GET', get(lambda: '/artists/{}/edit'.format(artist()))),
+        ('artist edit', 'POST', lambda: ('/artists/{}/edit'.format(artist()), {'data': ARTIST_FORM})),
+        ('shows', 'GET', get(lambda: '/shows')),
+        ('shows after cursor', 'GET', get(lambda: '/shows?after=' + cursor())),
+        ('show create form', 'GET', get(lambda: '/shows/create')),
+        ('show create', 'POST', lambda: ('/shows/create', {'data': show()})),
+        ('api venues', 'GET', get(lambda: '/api/v1/venues')),
+        ('api venue', 'GET', get(lambda: '/api/v1/venues/{}'.format(venue()))),
+        ('api venue shows', 'GET', get(lambda: '/api/v1/venues/{}/shows'.format(venue()))),
+        ('api venue search', 'GET', get(lambda: '/api/v1/venues/search?q=' + term())),
+        ('api venues nearby', 'GET', get(lambda: '/api/v1/venues/nearby?' + near())),
+        ('api venue recommendations', 'GET', get(lambda: '/api/v1/venues/{}/recommendations'.format(venue()))),
+        ('api artists', 'GET', get(lambda: '/api/v1/artists')),
+        ('api artist', 'GET', get(lambda: '/api/v1/artists/{}'.format(artist()))),
+        ('api artist shows', 'GET', get(lambda: '/api/v1/artists/{}/shows?when=past'.format(artist()))),
+        ('api artist search', 'GET', get(lambda: '/api/v1/artists/search?q=' + term())),
+        ('api shows', 'GET', get(lambda: '/api/v1/shows?after=' + cursor())),
+        ('api shows batch', 'POST', lambda: ('/api/v1/shows/batch',
+                                             {'json': {'shows': [show() for _ in range(10)]}})),
+        ('api series create', 'POST', lambda: ('/api/v1/series', {'json': dict(
+            show(), rule='FREQ=WEEKLY;COUNT=26')})),
+        ('api series delete', 'DELETE', lambda: ('/api/v1/series/{}'.format(next(disposable['series'])), {})),
+        ('cache stats', 'GET', get(lambda: '/cache/stats')),
+        ('metrics', 'GET', get(lambda: '/metrics')),
+    ]
+
+
+def run(args):
+    m = load_app(args.database, args.cold_cache)
+    from sqlalchemy import event
+    rng = random.Random(args.seed)
+    statements = Counter()
+
+    with m.app.app_context():
+        scale = {name: m.db.session.query(m.db.func.count(model.id)).scalar()
+                 for name, model in (('venues', m.Venue), ('artists', m.Artist),
+                                     ('shows', m.Show), ('series', m.ShowSeries))}
+        if not scale['venues'] or not scale['artists']:
+            sys.exit('No data in {}, run generate first'.format(args.database))
+        engine = m.db.engine
+        dialect = engine.dialect.name
+        # rows for the delete routes to remove, so the dataset keeps its size
+        calls = args.requests + args.warmup + 1
+        disposable = {}
+        start_time = datetime.datetime.now().replace(microsecond=0)
+        series = {'venue_id': 1, 'artist_id': 1, 'rule': 'FREQ=WEEKLY;COUNT=2', 'start_time': start_time,
+                  'last_start_time': m.last_occurrence('FREQ=WEEKLY;COUNT=2', start_time)}
+        for name, model, row in (('venues', m.Venue, {'name': 'Disposable', 'city': 'Austin', 'state': 'TX'}),
+                                 ('series', m.ShowSeries, series)):
+            instances = [model(**row) for _ in range(calls)]
+            m.db.session.add_all(instances)
+            if model is m.ShowSeries:
+                # counted as api_create_series does, as the deletes subtract them
+                m.record_series_counts(instances)
+            m.db.session.commit()
+            disposable[name] = iter([instance.id for instance in instances])
+        # the listing pages read their summaries, as when a worker keeps them fresh
+        for name in m.LISTING_SUMMARIES:
+            m.refresh_listing(name)
+        m.db.session.commit()
+        m.db.session.remove()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def count_statement(*args):
+        statements['count'] += 1
+
+    client = m.app.test_client()
+    results = {}
+    for name, method, make in scenarios(m, rng, scale, disposable):
+        if args.route and not any(pattern in name for pattern in args.route):
+            continue
+        latencies, queries, statuses = [], [], Counter()
+
+        def call():
+            path, options = make()
+            statements.clear()
+            started = time.perf_counter()
+            response = client.open(path, method=method, **options)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            response.close()
+            return elapsed, statements['count'], response.status_code
+
+        for _ in range(args.warmup):
+            call()
+        for _ in range(args.requests):
+            elapsed, count, status = call()
+            latencies.append(elapsed * 1000)
+            queries.append(count)
+            statuses[status] += 1
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            'method': method,
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+            'peak_alloc_kib': round(peak / 1024.0, 1),
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        }
+        print('{:<24} p50 {p50_ms:>9.2f}ms  p95 {p95_ms:>9.2f}ms  p99 {p99_ms:>9.2f}ms  '
+              '{queries_mean:>6.1f} queries  {peak_alloc_kib:>9.1f} KiB  {statuses}'.format(name, **results[name]))
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    report = {
+        'commit': commit,
+        'measured_at': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'database': dialect,
+        'scale': scale,
+        'seed': args.seed,
+        'cold_cache': args.cold_cache,
+        # resident set size peak of the whole run (KiB on Linux)
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'routes': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Saved to {}'.format(args.output))
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    print('{} -> {}'.format(baseline.get('commit'), current.get('commit')))
+    if baseline['scale'] != current['scale'] or baseline['database'] != current['database']:
+        print('warning: measured on different datasets or databases')
+    regressions = []
+    for name, result in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        flag = ''
+        if change > args.threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<24} p95 {:>9.2f}ms -> {:>9.2f}ms ({:+6.1f}%)  queries {:>6.1f} -> {:>6.1f}{}'.format(
+            name, before['p95_ms'], result['p95_ms'], change,
+            before['queries_mean'], result['queries_mean'], flag))
+    if regressions:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('generate', help='Recreate the schema and fill it with synthetic data.')
+    command.add_argument('--database', required=True, help='SQLAlchemy URL of a throwaway database.')
+    command.add_argument('--venues', type=int, default=1000)
+    command.add_argument('--artists', type=int, default=5000)
+    command.add_argument('--shows', type=int, default=100000)
+    command.add_argument('--series', type=int, default=200)
+    command.add_argument('--batch-size', type=int, default=10000)
+    command.add_argument('--seed', type=int, default=1)
+    command.set_defaults(handler=generate)
+
+    command = commands.add_parser('run', help='Time every route and save the results as JSON.')
+    command.add_argument('--database', required=True)
+    command.add_argument('--requests', type=int, default=50, help='Timed requests per route.')
+    command.add_argument('--warmup', type=int, default=3, help='Untimed requests per route first.')
+    command.add_argument('--route', action='append', help='Only routes whose name contains this.')
+    command.add_argument('--cold-cache', action='store_true', help='Disable the page cache.')
+    command.add_argument('--seed', type=int, default=1)
+    command.add_argument('--output', default='bench-results.json')
+    command.set_defaults(handler=run)
+
+    command = commands.add_parser('compare', help='Compare p95 latencies of two result files.')
+    command.add_argument('baseline')
+    command.add_argument('current')
+    command.add_argument('--threshold', type=float, default=10.0,
+                         help='Percent increase of p95 counted as a regression.')
+    command.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
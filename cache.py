@@ -0,0 +1,121 @@
+"""Page fragment cache with pluggable backends.
+
+``MemoryCache`` is an in-process LRU with per-entry TTL. ``RedisCache``
+stores entries in any Redis-compatible server (or in fakeredis for local
+development), which then owns eviction through its maxmemory policy.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache(object):
+
+    def __init__(self, max_entries=1000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class RedisCache(object):
+
+    def __init__(self, client, ttl=60, prefix='fyyur:page:', backend='redis'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value.decode('utf-8')
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, value.encode('utf-8'))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def stats(self):
+        # hits and misses are this process's view; evictions are server-wide
+        # and unavailable from stand-ins that do not implement INFO
+        try:
+            info = self.client.info('stats')
+        except Exception:
+            info = {}
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.backend,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': info.get('evicted_keys'),
+                'expirations': info.get('expired_keys'),
+            }
+
+
+def create_cache(config):
+    backend = config['CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryCache(config['CACHE_MAX_ENTRIES'], config['CACHE_TTL'])
+    if backend == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']), config['CACHE_TTL'])
+    if backend == 'fakeredis':
+        import fakeredis
+        return RedisCache(fakeredis.FakeRedis(), config['CACHE_TTL'], backend=backend)
+    raise ValueError('Unknown CACHE_BACKEND {!r}'.format(backend))
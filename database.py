@@ -0,0 +1,123 @@
+"""Flask-SQLAlchemy extension with the engine setup Fyyur relies on."""
+
+import os
+import time
+
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from metrics import registry
+from routing import Replica, ReplicaSet, RoutingSession
+
+pool_checkout_wait = registry.histogram(
+    'fyyur_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the pool, including connecting')
+pool_checkout_timeouts = registry.counter(
+    'fyyur_db_pool_checkout_timeouts_total',
+    'Pool checkouts that gave up after DATABASE_POOL_TIMEOUT')
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except Exception:
+            pool_checkout_timeouts.inc()
+            raise
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started)
+
+
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def record_connection_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def check_connection_pid(dbapi_connection, connection_record, connection_proxy):
+    # a pool created before gunicorn forks its workers (preload_app) would
+    # hand the parent's sockets to every child; drop them and reconnect
+    pid = os.getpid()
+    if connection_record.info['pid'] != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            'Connection record belongs to pid {}, attempting to check out in pid {}'.format(
+                connection_record.info['pid'], pid))
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+
+    replicas = ReplicaSet(())
+
+    def init_app(self, app):
+        super(SQLAlchemy, self).init_app(app)
+        self.replicas = ReplicaSet(
+            (Replica(repr(make_url(url)), self.create_replica_engine(app, url))
+             for url in app.config['DATABASE_REPLICA_URLS']),
+            max_lag=app.config['DATABASE_REPLICA_MAX_LAG'],
+            check_interval=app.config['DATABASE_REPLICA_CHECK_INTERVAL'])
+
+    def create_replica_engine(self, app, url):
+        # same options as the primary's engine, see _EngineConnector.get_options
+        sa_url = make_url(url)
+        options = {}
+        self.apply_pool_defaults(app, options)
+        self.apply_driver_hacks(app, sa_url, options)
+        options.update(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        options.update(self._engine_options)
+        return self.create_engine(sa_url, options)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        rv = super(SQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if sa_url.drivername.startswith('sqlite'):
+            # file and memory databases use their own pools, sized by SQLite
+            return rv
+        config = app.config
+        options.setdefault('poolclass', TimedQueuePool)
+        options.setdefault('pool_size', config['DATABASE_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DATABASE_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DATABASE_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', config['DATABASE_POOL_RECYCLE'])
+        options.setdefault('pool_pre_ping', config['DATABASE_POOL_PRE_PING'])
+        if sa_url.get_dialect().driver == 'psycopg2':
+            # executemany() as multi-row INSERT ... VALUES pages instead of a
+            # round trip per row
+            options.setdefault('executemany_mode', 'values')
+        timeout = config['DATABASE_STATEMENT_TIMEOUT']
+        if timeout and sa_url.drivername.startswith('postgres'):
+            connect_args = options.setdefault('connect_args', {})
+            connect_args.setdefault('options', '-c statement_timeout={:d}'.format(timeout))
+        return rv
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', enable_sqlite_foreign_keys)
+        event.listen(engine, 'connect', record_connection_pid)
+        event.listen(engine, 'checkout', check_connection_pid)
+        return engine
+
+    def pool_status(self):
+        """Checked out and idle connections of the default engine's pool."""
+        pool = self.engine.pool
+        if not isinstance(pool, QueuePool):
+            return None
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        }
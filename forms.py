@@ -1,11 +1,12 @@
 from datetime import datetime
 from flask_wtf import Form
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
 
 class ShowForm(Form):
     artist_id = IntegerField(
-        'artist_id'
+        'artist_id',
+        validators=[DataRequired()]
     )
     venue_id = IntegerField(
         'venue_id',
@@ -16,6 +17,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # minutes, SHOW_DEFAULT_DURATION_MINUTES when left empty
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1)]
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -0,0 +1,164 @@
+"""Venue coordinates: geohashes, radius bounding boxes and an offline gazetteer.
+
+A geohash names a cell of a latitude/longitude grid; every extra character
+splits the cell into 32, and cells sharing a prefix are nested, so the
+venues inside a cell are one range of an ordinary B-tree index on the
+geohash column. A radius query covers its bounding box with a handful of
+cells, reads those ranges and keeps the venues actually within the radius.
+
+Coordinates come from a GeoNames-style gazetteer (tab separated, as in the
+citiesNNN.txt dumps), matched on a venue's city and state, so geocoding
+needs no network and places a venue at its city's centre.
+"""
+
+import csv
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# characters stored per venue, cells of about 5 m
+GEOHASH_PRECISION = 9
+# most cells a radius query reads; the precision drops until its bounding
+# box fits in this many
+MAX_COVER_CELLS = 32
+EARTH_RADIUS_KM = 6371.0088
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """The geohash of the cell containing the point."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Height and width in degrees of the cells of a geohash precision."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points (haversine)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(latitude, longitude, radius_km):
+    """(south, west, north, east) boxes containing every point within the
+    radius, split in two where the circle crosses the antimeridian."""
+    delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = latitude - delta, latitude + delta
+    if south <= -90 or north >= 90:
+        # the circle takes in a pole, and so every longitude
+        return [(max(south, -90.0), -180.0, min(north, 90.0), 180.0)]
+    delta_lon = math.degrees(math.asin(math.sin(math.radians(delta)) /
+                                       math.cos(math.radians(latitude))))
+    west, east = longitude - delta_lon, longitude + delta_lon
+    if west < -180:
+        return [(south, west + 360, north, 180.0), (south, -180.0, north, east)]
+    if east > 180:
+        return [(south, west, north, 180.0), (south, -180.0, north, east - 360)]
+    return [(south, west, north, east)]
+
+
+def covering_cells(boxes):
+    """Geohash prefixes whose cells together cover the boxes, as few as
+    MAX_COVER_CELLS allows at the finest precision that needs no more."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows_and_columns = [
+            (range(int(math.floor(south / height)), int(math.floor(min(north, 90 - height / 2) / height)) + 1),
+             range(int(math.floor(west / width)), int(math.floor(min(east, 180 - width / 2) / width)) + 1))
+            for south, west, north, east in boxes
+        ]
+        if sum(len(rows) * len(columns) for rows, columns in rows_and_columns) <= MAX_COVER_CELLS \
+                or precision == 1:
+            break
+    # the centre of each grid cell names it
+    return sorted({geohash((row + 0.5) * height, (column + 0.5) * width, precision)
+                   for rows, columns in rows_and_columns for row in rows for column in columns})
+
+
+def in_range(latitude, longitude):
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def parse_location(latitude, longitude, radius, default_radius, max_radius):
+    """(latitude, longitude, radius in km) from query string values.
+
+    Raises ValueError for missing, malformed or out of range values.
+    """
+    if not latitude or not longitude:
+        raise ValueError('lat and lon are required')
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+        radius = float(radius) if radius else default_radius
+    except ValueError:
+        raise ValueError('lat, lon and radius must be numbers')
+    if not in_range(latitude, longitude):
+        raise ValueError('lat must be within -90 and 90, lon within -180 and 180')
+    if not 0 < radius <= max_radius:
+        raise ValueError('radius must be above 0 and at most {:g} km'.format(max_radius))
+    return latitude, longitude, radius
+
+
+def normalize_place(name):
+    return ' '.join(name.lower().split())
+
+
+class Gazetteer(object):
+    """Coordinates of places by (name, region code), e.g. ('austin', 'TX')."""
+
+    def __init__(self, places=None):
+        self.places = places or {}
+
+    @classmethod
+    def load(cls, path):
+        """Read a GeoNames dump: name and ascii name in columns 2 and 3,
+        latitude and longitude in 5 and 6, the admin1 (state) code in 11 and
+        the population in 15. Of places sharing a name and state the most
+        populous wins."""
+        places = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                if len(row) < 15:
+                    continue
+                try:
+                    latitude, longitude = float(row[4]), float(row[5])
+                    population = int(row[14] or 0)
+                except ValueError:
+                    continue
+                region = row[10].upper()
+                for name in {normalize_place(row[1]), normalize_place(row[2])}:
+                    key = (name, region)
+                    if key not in places or places[key][2] < population:
+                        places[key] = (latitude, longitude, population)
+        return cls(places)
+
+    def __len__(self):
+        return len(self.places)
+
+    def locate(self, city, state):
+        """(latitude, longitude) of the city, or None."""
+        place = self.places.get((normalize_place(city or ''), (state or '').strip().upper()))
+        return place[:2] if place else None
@@ -0,0 +1,67 @@
+"""gunicorn settings for serving wsgi:application.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+GUNICORN_WORKER_CLASS picks the worker model:
+
+* ``gthread`` (default): each process serves GUNICORN_THREADS requests at
+  once. Keep DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW at or above the
+  thread count.
+* ``sync``: one request per process. Only for few, fast clients, since a
+  slow client holds a whole worker.
+* ``gevent``: GUNICORN_WORKER_CONNECTIONS greenlets per process, for many
+  slow clients. Needs the gevent package, and psycogreen so psycopg2 waits
+  on the hub instead of blocking the process.
+
+The app is imported once in the master and forked (preload_app), except
+under gevent, whose monkey patching has to happen before anything else is
+imported. Workers are replaced after GUNICORN_MAX_REQUESTS requests, give
+or take the jitter, so they do not all restart at once. On SIGHUP gunicorn
+starts new workers and stops the old ones gracefully. With preload those
+workers still run the code the master loaded, so deploy new code with
+SIGUSR2 (a new master) followed by SIGTERM to the old master.
+"""
+
+import multiprocessing
+import os
+import time
+
+# read when wsgi.py imports the app, in the master with preload_app
+os.environ.setdefault('FYYUR_ENV', 'production')
+os.environ.setdefault('FYYUR_CLI_MIGRATIONS', 'false')
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '7002'))
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+preload_app = worker_class != 'gevent'
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+# seconds a worker may spend on one request, and to finish on shutdown
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning('psycogreen is not installed, psycopg2 blocks gevent workers')
+        else:
+            patch_psycopg()
+
+
+def post_worker_init(worker):
+    # the time from fork until the worker accepts requests; without preload
+    # it includes importing the app
+    worker.log.info('Worker %s ready in %.0f ms', worker.pid,
+                    (time.perf_counter() - worker.forked_at) * 1000)
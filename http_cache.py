@@ -0,0 +1,95 @@
+"""Conditional GET: weak ETags, Last-Modified and Cache-Control on pages.
+
+A page's stamp is when what it shows last changed, found before the page is
+built: a row's updated_at, a summary's refresh time, the templates'
+modification time. The validators derive from the stamp rather than from
+the rendered body, so a request whose If-None-Match or If-Modified-Since
+still holds is answered 304 for the cost of finding the stamp, at most one
+indexed lookup, and the view never runs. The ETag also carries a version,
+by default the templates' modification time, so a deploy changing them
+changes every ETag.
+
+Stamps are naive local datetimes, like the rest of the app's times.
+"""
+
+import datetime
+import functools
+import os
+
+from flask import current_app, request, session
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+
+@functools.lru_cache(maxsize=None)
+def templates_modified(template_folder):
+    """When a template last changed, read once per process."""
+    latest = 0
+    for directory, _, names in os.walk(template_folder):
+        for name in names:
+            latest = max(latest, os.path.getmtime(os.path.join(directory, name)))
+    return datetime.datetime.fromtimestamp(latest)
+
+
+def page_version(app):
+    return app.config['HTTP_CACHE_VERSION'] or \
+        templates_modified(os.path.join(app.root_path, app.template_folder)).strftime('%Y%m%d%H%M%S')
+
+
+def http_time(stamp):
+    # HTTP dates are UTC and in whole seconds
+    return datetime.datetime.utcfromtimestamp(int(stamp.timestamp()))
+
+
+def page_tag(stamp, version):
+    return '{}-{:%Y%m%d%H%M%S%f}'.format(version, stamp)
+
+
+def is_modified(stamp, version, if_none_match=None, if_modified_since=None):
+    """Whether a client sending these If-None-Match and If-Modified-Since
+    values needs the page again; If-None-Match wins when both are sent."""
+    if if_none_match:
+        return not parse_etags(if_none_match).contains_weak(page_tag(stamp, version))
+    since = parse_date(if_modified_since) if if_modified_since else None
+    return since is None or http_time(stamp) > since.replace(tzinfo=None)
+
+
+def cache_headers(stamp, version, cache_control):
+    """Headers of a 200 or 304 response for a page with the given stamp,
+    or with no validators when stamp is None."""
+    headers = {'Cache-Control': cache_control}
+    if stamp is not None:
+        headers['ETag'] = quote_etag(page_tag(stamp, version), weak=True)
+        headers['Last-Modified'] = http_date(http_time(stamp))
+    return headers
+
+
+def conditional(stamp=None, cache_control=None):
+    """Add validators and Cache-Control to the decorated view's responses,
+    and answer 304 without running the view when the client's copy is
+    current.
+
+    stamp is called with the view's arguments and returns the page's stamp,
+    or None for a response without validators. cache_control defaults to
+    HTTP_CACHE_CONTROL.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            policy = cache_control or current_app.config['HTTP_CACHE_CONTROL']
+            version = page_version(current_app)
+            modified = None
+            # flashed messages are rendered into the page they are popped by
+            if stamp is not None and request.method in ('GET', 'HEAD') and '_flashes' not in session:
+                modified = stamp(*args, **kwargs)
+            if modified is not None and not is_modified(modified, version,
+                                                        request.headers.get('If-None-Match'),
+                                                        request.headers.get('If-Modified-Since')):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                for name, value in cache_headers(modified, version, policy).items():
+                    response.headers.setdefault(name, value)
+            return response
+        return wrapper
+    return decorate
@@ -0,0 +1,166 @@
+"""Streaming readers, row validation and checkpoints for bulk imports.
+
+Rows are read one at a time from CSV or NDJSON files, so memory is bounded by
+the batch being inserted rather than by the size of the file. Nothing here
+touches the models; the ``import`` command in app.py wires them in.
+"""
+
+import csv
+import io
+import json
+import os
+
+from werkzeug.datastructures import MultiDict
+
+FORMATS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+}
+
+# Fields holding several values: a list in NDJSON, comma separated in CSV
+LIST_FIELDS = ('genres',)
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError('Cannot tell the format of {} from its extension, '
+                         'expected one of {}'.format(path, ', '.join(sorted(FORMATS))))
+    return FORMATS[extension]
+
+
+def read_rows(path, format=None, skip=0):
+    """Yield ``(record number, row)`` for the records of a CSV or NDJSON file.
+
+    Records are numbered from 1; the first ``skip`` are read past without
+    being decoded where the format allows it.
+    """
+    format = format or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        if format == 'csv':
+            for number, row in enumerate(csv.DictReader(f), 1):
+                if number > skip:
+                    yield number, row
+            return
+        number = 0
+        for line in f:
+            if not line.strip():
+                continue
+            number += 1
+            if number > skip:
+                yield number, json.loads(line)
+
+
+def formdata(row):
+    """The row as the form data a browser would have posted."""
+    data = MultiDict()
+    for key, value in row.items():
+        if value is None or value == '':
+            continue
+        if isinstance(value, list):
+            values = value
+        elif key in LIST_FIELDS:
+            values = [item.strip() for item in str(value).split(',') if item.strip()]
+        else:
+            values = [value]
+        for item in values:
+            data.add(key, item if isinstance(item, str) else str(item))
+    return data
+
+
+def parse_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 't')
+
+
+class RowValidator(object):
+    """Validates rows against a form class, reusing one form instance.
+
+    Calling it returns ``(data, None)`` for a valid row and ``(None, errors)``
+    otherwise, with the form's ``data`` and ``errors`` dicts.
+    """
+
+    def __init__(self, form_class):
+        from wtforms.validators import DataRequired
+        # no request to take data or a CSRF token from
+        self.form = form_class(formdata=None, meta={'csrf': False})
+        self.required = [field.name for field in self.form
+                         if any(isinstance(validator, DataRequired) for validator in field.validators)]
+
+    def __call__(self, row):
+        form = self.form
+        form.process(formdata(row))
+        valid = form.validate()
+        # a field missing from the file would otherwise take the form's
+        # default (start_time defaults to today) and pass DataRequired
+        missing = [name for name in self.required if not form[name].raw_data]
+        if valid and not missing:
+            return dict(form.data), None
+        errors = dict(form.errors)
+        for name in missing:
+            errors[name] = ['This field is required.']
+        return None, errors
+
+
+class Checkpoint(object):
+    """Progress of an import, saved after every committed batch.
+
+    The file records how many records of the source were handled, so a
+    rerun resumes after the last committed batch. It is bound to the source's
+    path and size; a different file needs a fresh start.
+    """
+
+    def __init__(self, path, source, kind):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.kind = kind
+        self.size = os.path.getsize(source)
+        self.done = self.inserted = self.rejected = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path) as f:
+            state = json.load(f)
+        if (state['source'], state['size'], state['kind']) != (self.source, self.size, self.kind):
+            raise ValueError('Checkpoint {} belongs to another import ({} {}), '
+                             'restart to discard it'.format(self.path, state['kind'], state['source']))
+        self.done, self.inserted, self.rejected = state['done'], state['inserted'], state['rejected']
+        return self
+
+    def save(self):
+        # written aside and renamed, so a crash never leaves half a checkpoint
+        partial = self.path + '.partial'
+        with open(partial, 'w') as f:
+            json.dump({
+                'source': self.source,
+                'size': self.size,
+                'kind': self.kind,
+                'done': self.done,
+                'inserted': self.inserted,
+                'rejected': self.rejected,
+            }, f)
+        os.replace(partial, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def copy_rows(connection, table, columns, rows):
+    """Insert rows (dicts) into table with Postgres' COPY, in the current transaction."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    statement = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        preparer.format_table(table), ', '.join(preparer.quote(column) for column in columns))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
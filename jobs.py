@@ -0,0 +1,193 @@
+"""Background jobs kept in a database table, with retries and periodic jobs.
+
+A job is a row naming a registered task and the JSON keyword arguments to
+call it with. Enqueueing inserts the row in the caller's transaction, so a
+write that rolls back leaves no job behind. Workers claim due jobs for a
+lease of JOBS_LEASE_SECONDS: on Postgres the claim skips rows other
+workers hold (FOR UPDATE SKIP LOCKED), and a conditional UPDATE settles
+races elsewhere. The task runs in the worker's session and the job row is
+deleted in the same transaction, so a task's database writes happen once
+even when a lease runs out and another worker takes the job over.
+
+A task that raises is retried after JOBS_RETRY_DELAY seconds, doubled on
+every attempt, and kept as failed once it has run JOBS_MAX_ATTEMPTS times.
+Periodic jobs are single rows keyed by task name that are rescheduled after
+every run instead of being deleted, and never fail for good.
+"""
+
+import datetime
+import json
+import os
+import socket
+import time
+import traceback
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from metrics import registry
+
+job_runs = registry.counter(
+    'fyyur_jobs_total', 'Jobs run by workers, by outcome', ('name', 'outcome'))
+job_duration = registry.histogram(
+    'fyyur_job_duration_seconds', 'Wall time of jobs', ('name',))
+
+
+def worker_name(index=0):
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), index)
+
+
+class JobQueue(object):
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.tasks = {}
+        self.schedules = {}
+
+    def task(self, name=None):
+        """Register the decorated function as the task called name."""
+        def register(function):
+            self.tasks[name or function.__name__] = function
+            return function
+        return register
+
+    def schedule(self, name, every):
+        """Run the task called name every this many seconds."""
+        self.schedules[name] = every
+
+    def enqueue(self, name, delay=0, **kwargs):
+        """Add a job running the task name after delay seconds, in the
+        current transaction."""
+        if name not in self.tasks:
+            raise LookupError('No task named {}'.format(name))
+        self.db.session.execute(self.table.insert().values(
+            name=name,
+            kwargs=json.dumps(kwargs),
+            run_at=datetime.datetime.now() + datetime.timedelta(seconds=delay),
+            attempts=0,
+            max_attempts=current_app.config['JOBS_MAX_ATTEMPTS']))
+
+    def ensure_schedules(self):
+        # one row per periodic task; workers starting together race to
+        # insert it and the unique key keeps one
+        table = self.table
+        session = self.db.session
+        for name, every in self.schedules.items():
+            updated = session.execute(table.update().where(table.c.key == name).values(every=every))
+            if updated.rowcount:
+                session.commit()
+                continue
+            try:
+                session.execute(table.insert().values(
+                    key=name, name=name, kwargs='{}', every=every, run_at=datetime.datetime.now(),
+                    attempts=0, max_attempts=current_app.config['JOBS_MAX_ATTEMPTS']))
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+
+    def claimable(self, now):
+        table = self.table
+        return and_(table.c.failed_at.is_(None), table.c.run_at <= now,
+                    or_(table.c.locked_until.is_(None), table.c.locked_until < now))
+
+    def claim(self, worker):
+        """The next due job, leased to worker, or None."""
+        table = self.table
+        session = self.db.session
+        now = datetime.datetime.now()
+        claimable = self.claimable(now)
+        job_id = session.execute(
+            select([table.c.id]).where(claimable).order_by(table.c.run_at).limit(1)
+            .with_for_update(skip_locked=True)).scalar()
+        if job_id is None:
+            session.rollback()
+            return None
+        claimed = session.execute(table.update().where(and_(table.c.id == job_id, claimable)).values(
+            locked_until=now + datetime.timedelta(seconds=current_app.config['JOBS_LEASE_SECONDS']),
+            locked_by=worker,
+            attempts=table.c.attempts + 1))
+        if claimed.rowcount != 1:
+            # another worker claimed it between the two statements
+            session.rollback()
+            return None
+        job = session.execute(select([table]).where(table.c.id == job_id)).first()
+        session.commit()
+        return job
+
+    def run(self, job, worker):
+        table = self.table
+        session = self.db.session
+        mine = and_(table.c.id == job.id, table.c.locked_by == worker)
+        started = time.perf_counter()
+        try:
+            task = self.tasks.get(job.name)
+            if task is None:
+                raise LookupError('No task named {}'.format(job.name))
+            task(**json.loads(job.kwargs))
+            if job.every:
+                done = session.execute(table.update().where(mine).values(
+                    run_at=datetime.datetime.now() + datetime.timedelta(seconds=job.every),
+                    attempts=0, locked_until=None, locked_by=None, last_error=None))
+            else:
+                done = session.execute(table.delete().where(mine))
+            if done.rowcount != 1:
+                # the lease ran out and another worker has the job now
+                session.rollback()
+                outcome = 'lost'
+            else:
+                session.commit()
+                outcome = 'done'
+        except Exception:
+            session.rollback()
+            outcome = self.fail(job, worker, traceback.format_exc())
+        duration = time.perf_counter() - started
+        job_runs.inc(name=job.name, outcome=outcome)
+        job_duration.observe(duration, name=job.name)
+        return outcome
+
+    def fail(self, job, worker, error):
+        table = self.table
+        session = self.db.session
+        now = datetime.datetime.now()
+        values = {'locked_until': None, 'locked_by': None, 'last_error': error}
+        if job.attempts >= job.max_attempts and not job.every:
+            values['failed_at'] = now
+            outcome = 'failed'
+        else:
+            delay = current_app.config['JOBS_RETRY_DELAY'] * 2 ** (min(job.attempts, job.max_attempts) - 1)
+            values['run_at'] = now + datetime.timedelta(seconds=delay)
+            outcome = 'retried'
+        session.execute(table.update().where(and_(table.c.id == job.id, table.c.locked_by == worker))
+                        .values(**values))
+        session.commit()
+        current_app.logger.error('Job %s %s (%s, attempt %d of %d): %s', job.id, job.name, outcome,
+                                 job.attempts, job.max_attempts, error)
+        return outcome
+
+    def work(self, worker, stop, burst=False):
+        """Run due jobs until stop is set, or until none is due when burst."""
+        poll_interval = current_app.config['JOBS_POLL_INTERVAL']
+        while not stop.is_set():
+            job = self.claim(worker)
+            if job is not None:
+                self.run(job, worker)
+            elif burst and not self.due():
+                return
+            else:
+                stop.wait(poll_interval)
+
+    def due(self):
+        count = self.db.session.execute(select([func.count()]).select_from(self.table)
+                                        .where(self.claimable(datetime.datetime.now()))).scalar()
+        self.db.session.rollback()
+        return count
+
+    def status(self):
+        """Queued (including periodic) and failed jobs."""
+        table = self.table
+        queued, failed = self.db.session.execute(select([
+            func.count(table.c.id) - func.count(table.c.failed_at), func.count(table.c.failed_at)
+        ])).first()
+        return {'queued': queued, 'failed': failed}
@@ -0,0 +1,120 @@
+"""Minimal in-process metrics rendered in the Prometheus text format.
+
+Values are per process; with several workers each one reports its own, as
+with any multi-process Prometheus target scraped per worker.
+"""
+
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter(object):
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(object):
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        names = self.labelnames + ('le',)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((self.name + '_bucket', _labels(names, key + (bound,)), bucket_count))
+                samples.append((self.name + '_bucket', _labels(names, key + ('+Inf',)), count))
+                samples.append((self.name + '_sum', _labels(self.labelnames, key), total))
+                samples.append((self.name + '_count', _labels(self.labelnames, key), count))
+        return samples
+
+
+class Gauge(object):
+    """Value read from a callback at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        return [] if value is None else [(self.name, '', value)]
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
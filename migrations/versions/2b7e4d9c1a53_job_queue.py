@@ -0,0 +1,41 @@
+"""job table for background work
+
+Revision ID: 2b7e4d9c1a53
+Revises: f1c8d2a4b6e9
+Create Date: 2026-10-18 19:14:52.318407
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e4d9c1a53'
+down_revision = 'f1c8d2a4b6e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('kwargs', sa.Text(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('locked_by', sa.String(length=200), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('failed_at', sa.DateTime(), nullable=True),
+        sa.Column('every', sa.Integer(), nullable=True),
+        sa.Column('key', sa.String(length=100), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('key')
+    )
+    op.create_index('ix_job_run_at', 'job', ['run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_job_run_at', table_name='job')
+    op.drop_table('job')
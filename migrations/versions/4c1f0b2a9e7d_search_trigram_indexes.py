@@ -0,0 +1,44 @@
+"""trigram indexes for venue and artist search
+
+Revision ID: 4c1f0b2a9e7d
+Revises: d99e56b8228e
+Create Date: 2026-10-18 09:12:31.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1f0b2a9e7d'
+down_revision = 'd99e56b8228e'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_Venue_name_trgm', 'Venue', 'name'),
+    ('ix_Venue_city_trgm', 'Venue', 'city'),
+    ('ix_Venue_genres_trgm', 'Venue', 'genres'),
+    ('ix_Artist_name_trgm', 'Artist', 'name'),
+    ('ix_Artist_city_trgm', 'Artist', 'city'),
+    ('ix_Artist_genres_trgm', 'Artist', 'genres'),
+]
+
+
+def upgrade():
+    # other databases fall back to the in-process index in search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in INDEXES:
+        op.create_index(name, table, [column], unique=False,
+                        postgresql_using='gin',
+                        postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, table, column in INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,96 @@
+"""normalized genres with venue and artist association tables
+
+Revision ID: 7a3d5e91c2b4
+Revises: 4c1f0b2a9e7d
+Create Date: 2026-10-18 11:40:02.877415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3d5e91c2b4'
+down_revision = '4c1f0b2a9e7d'
+branch_labels = None
+depends_on = None
+
+
+ENTITIES = [
+    ('Venue', 'venue_genres', 'venue_id'),
+    ('Artist', 'artist_genres', 'artist_id'),
+]
+
+
+def upgrade():
+    genre = op.create_table('genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    associations = {}
+    for table, association, key in ENTITIES:
+        associations[table] = op.create_table(association,
+        sa.Column(key, sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint([key], [table + '.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(key, 'genre_id')
+        )
+        op.create_index('ix_{}_genre_id_{}'.format(association, key), association,
+                        ['genre_id', key], unique=False)
+
+    # backfill from the comma-joined strings
+    conn = op.get_bind()
+    entity_genres = {}
+    for table, association, key in ENTITIES:
+        rows = conn.execute(sa.text('SELECT id, genres FROM "{}"'.format(table)))
+        entity_genres[table] = [
+            (entity_id, [name for name in dict.fromkeys(genres.split(',')) if name])
+            for entity_id, genres in rows if genres
+        ]
+    names = sorted({name for rows in entity_genres.values()
+                    for _, genres in rows for name in genres})
+    if names:
+        op.bulk_insert(genre, [{'name': name} for name in names])
+    genre_ids = dict((name, genre_id) for genre_id, name in
+                     conn.execute(sa.text('SELECT id, name FROM genre')))
+    for table, association, key in ENTITIES:
+        rows = [{key: entity_id, 'genre_id': genre_ids[name]}
+                for entity_id, genres in entity_genres[table] for name in genres]
+        if rows:
+            op.bulk_insert(associations[table], rows)
+
+    if conn.dialect.name == 'postgresql':
+        op.drop_index('ix_Venue_genres_trgm', table_name='Venue')
+        op.drop_index('ix_Artist_genres_trgm', table_name='Artist')
+    for table, association, key in ENTITIES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('genres')
+
+
+def downgrade():
+    conn = op.get_bind()
+    for table, association, key in ENTITIES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('genres', sa.String(length=200), nullable=True))
+        entity = sa.table(table, sa.column('id', sa.Integer), sa.column('genres', sa.String))
+        genres = {}
+        rows = conn.execute(sa.text(
+            'SELECT a.{key}, g.name FROM {association} a JOIN genre g ON g.id = a.genre_id '
+            'ORDER BY a.{key}, g.name'.format(key=key, association=association)))
+        for entity_id, name in rows:
+            genres.setdefault(entity_id, []).append(name)
+        for entity_id, names in genres.items():
+            conn.execute(entity.update().where(entity.c.id == entity_id)
+                         .values(genres=','.join(names)))
+        op.drop_index('ix_{}_genre_id_{}'.format(association, key), table_name=association)
+        op.drop_table(association)
+    op.drop_table('genre')
+
+    if conn.dialect.name == 'postgresql':
+        for table in ('Venue', 'Artist'):
+            op.create_index('ix_{}_genres_trgm'.format(table), table, ['genres'], unique=False,
+                            postgresql_using='gin',
+                            postgresql_ops={'genres': 'gin_trgm_ops'})
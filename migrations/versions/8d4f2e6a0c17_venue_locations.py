@@ -0,0 +1,37 @@
+"""latitude, longitude and geohash on Venue, with spatial indexes
+
+Revision ID: 8d4f2e6a0c17
+Revises: 2b7e4d9c1a53
+Create Date: 2026-10-18 20:31:07.514226
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4f2e6a0c17'
+down_revision = '2b7e4d9c1a53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False)
+    # postgres answers radius queries from a GiST index on the built-in
+    # point type, which needs no extension
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE INDEX "ix_Venue_location" ON "Venue" USING gist (point(longitude, latitude))')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_Venue_location', table_name='Venue')
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
@@ -0,0 +1,97 @@
+"""summaries of the venue, artist and show listings
+
+Revision ID: a4e7b1d9c3f6
+Revises: c6a1f3e8d250
+Create Date: 2026-10-18 23:12:48.517302
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e7b1d9c3f6'
+down_revision = 'c6a1f3e8d250'
+branch_labels = None
+depends_on = None
+
+
+# the queries of listing_sources() in app.py; :now is the time of the refresh
+SOURCES = {
+    'venue_listing':
+        'SELECT id, name, city, state, upcoming_show_count AS num_upcoming_shows FROM "Venue"',
+    'artist_listing':
+        'SELECT id, name, upcoming_show_count AS num_upcoming_shows FROM "Artist"',
+    'show_feed':
+        'SELECT show.id, show.start_time, show.venue_id, "Venue".name AS venue_name, '
+        'show.artist_id, "Artist".name AS artist_name, "Artist".image_link AS artist_image_link '
+        'FROM show JOIN "Venue" ON "Venue".id = show.venue_id '
+        'JOIN "Artist" ON "Artist".id = show.artist_id WHERE show.start_time > :now',
+}
+
+INDEXES = [
+    ('ix_venue_listing_state_city_id', 'venue_listing', ['state', 'city', 'id']),
+    ('ix_show_feed_start_time_id', 'show_feed', ['start_time', 'id']),
+]
+
+
+def upgrade():
+    listing_refresh = op.create_table('listing_refresh',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    now = datetime.datetime.now()
+    connection = op.get_bind()
+
+    if connection.dialect.name == 'postgresql':
+        # a concurrent refresh needs a unique index on plain columns
+        for name, source in SOURCES.items():
+            op.execute('CREATE MATERIALIZED VIEW {} AS {}'.format(
+                name, source.replace(':now', 'LOCALTIMESTAMP')))
+            op.execute('CREATE UNIQUE INDEX ix_{0}_id ON {0} (id)'.format(name))
+    else:
+        op.create_table('venue_listing',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('city', sa.String(length=120), nullable=True),
+            sa.Column('state', sa.String(length=120), nullable=True),
+            sa.Column('num_upcoming_shows', sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_table('artist_listing',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('num_upcoming_shows', sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_table('show_feed',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('start_time', sa.DateTime(), nullable=True),
+            sa.Column('venue_id', sa.Integer(), nullable=True),
+            sa.Column('venue_name', sa.String(), nullable=True),
+            sa.Column('artist_id', sa.Integer(), nullable=True),
+            sa.Column('artist_name', sa.String(), nullable=True),
+            sa.Column('artist_image_link', sa.String(length=500), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        for name, source in SOURCES.items():
+            connection.execute(sa.text('INSERT INTO {} {}'.format(name, source)), now=now)
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+    op.bulk_insert(listing_refresh, [{'name': name, 'refreshed_at': now} for name in SOURCES])
+
+
+def downgrade():
+    for name, table, columns in INDEXES:
+        op.drop_index(name, table_name=table)
+    if op.get_bind().dialect.name == 'postgresql':
+        for name in SOURCES:
+            op.execute('DROP MATERIALIZED VIEW {}'.format(name))
+    else:
+        for name in SOURCES:
+            op.drop_table(name)
+    op.drop_table('listing_refresh')
@@ -0,0 +1,75 @@
+"""indexes for show lookups and NOT NULL / ON DELETE CASCADE on show
+
+Revision ID: b5e2c7d81f3a
+Revises: 7a3d5e91c2b4
+Create Date: 2026-10-18 13:05:44.619320
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e2c7d81f3a'
+down_revision = '7a3d5e91c2b4'
+branch_labels = None
+depends_on = None
+
+
+def show_table(nullable, ondelete):
+    # full definition of show, used to rebuild the table on SQLite, which
+    # cannot alter columns or foreign keys in place
+    return sa.Table('show', sa.MetaData(),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('start_time', sa.DateTime(), nullable=nullable),
+        sa.Column('artist_id', sa.Integer(), nullable=nullable),
+        sa.Column('venue_id', sa.Integer(), nullable=nullable),
+        sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete=ondelete),
+        sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete=ondelete),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def upgrade():
+    # shows without an artist, a venue or a time were never displayed
+    op.execute('DELETE FROM show WHERE artist_id IS NULL OR venue_id IS NULL OR start_time IS NULL')
+
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('show', recreate='always',
+                                  copy_from=show_table(False, 'CASCADE')):
+            pass
+    else:
+        for column in ('start_time', 'artist_id', 'venue_id'):
+            op.alter_column('show', column, existing_type=sa.Integer() if column != 'start_time'
+                            else sa.DateTime(), nullable=False)
+        op.drop_constraint('show_artist_id_fkey', 'show', type_='foreignkey')
+        op.drop_constraint('show_venue_id_fkey', 'show', type_='foreignkey')
+        op.create_foreign_key('show_artist_id_fkey', 'show', 'Artist', ['artist_id'], ['id'],
+                              ondelete='CASCADE')
+        op.create_foreign_key('show_venue_id_fkey', 'show', 'Venue', ['venue_id'], ['id'],
+                              ondelete='CASCADE')
+
+    op.create_index('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_show_start_time_id', 'show', ['start_time', 'id'], unique=False)
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
+    op.drop_index('ix_show_start_time_id', table_name='show')
+    op.drop_index('ix_show_artist_id_start_time', table_name='show')
+    op.drop_index('ix_show_venue_id_start_time', table_name='show')
+
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('show', recreate='always',
+                                  copy_from=show_table(True, None)):
+            pass
+    else:
+        op.drop_constraint('show_artist_id_fkey', 'show', type_='foreignkey')
+        op.drop_constraint('show_venue_id_fkey', 'show', type_='foreignkey')
+        op.create_foreign_key('show_artist_id_fkey', 'show', 'Artist', ['artist_id'], ['id'])
+        op.create_foreign_key('show_venue_id_fkey', 'show', 'Venue', ['venue_id'], ['id'])
+        for column in ('start_time', 'artist_id', 'venue_id'):
+            op.alter_column('show', column, existing_type=sa.Integer() if column != 'start_time'
+                            else sa.DateTime(), nullable=True)
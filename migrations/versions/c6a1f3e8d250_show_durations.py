@@ -0,0 +1,73 @@
+"""end_time on show and duration on show_series, no overlapping bookings
+
+Revision ID: c6a1f3e8d250
+Revises: 8d4f2e6a0c17
+Create Date: 2026-10-18 21:47:36.208954
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6a1f3e8d250'
+down_revision = '8d4f2e6a0c17'
+branch_labels = None
+depends_on = None
+
+
+# minutes given to the existing shows, SHOW_DEFAULT_DURATION_MINUTES
+DEFAULT_DURATION = 120
+
+CONSTRAINTS = [
+    ('show_venue_id_no_overlap', 'venue_id'),
+    ('show_artist_id_no_overlap', 'artist_id'),
+]
+
+
+def upgrade():
+    op.add_column('show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.add_column('show_series', sa.Column('duration', sa.Integer(), nullable=False,
+                                           server_default=str(DEFAULT_DURATION)))
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        op.execute("UPDATE show SET end_time = start_time + interval '{:d} minutes'".format(DEFAULT_DURATION))
+    else:
+        # SQLite's date functions would store the times in another format
+        show = sa.table('show', sa.column('id', sa.Integer), sa.column('start_time', sa.DateTime),
+                        sa.column('end_time', sa.DateTime))
+        length = datetime.timedelta(minutes=DEFAULT_DURATION)
+        rows = [{'show_id': show_id, 'end_time': start_time + length}
+                for show_id, start_time in connection.execute(sa.select([show.c.id, show.c.start_time]))]
+        if rows:
+            connection.execute(show.update().where(show.c.id == sa.bindparam('show_id')), rows)
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    if connection.dialect.name != 'postgresql':
+        return
+    # the database rejects overlapping shows committed concurrently, which
+    # the checks in app.py cannot see; shows already overlapping have to be
+    # moved or removed before this can be applied
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for name, column in CONSTRAINTS:
+        overlapping = connection.execute(sa.text(
+            'SELECT a.id, b.id FROM show a JOIN show b ON a.{0} = b.{0} AND a.id < b.id '
+            'AND a.start_time < b.end_time AND b.start_time < a.end_time LIMIT 5'.format(column))).fetchall()
+        if overlapping:
+            raise RuntimeError('Shows with the same {} overlap, e.g. {}; fix them and run the '
+                               'migration again'.format(column, overlapping))
+        op.execute('ALTER TABLE show ADD CONSTRAINT {} EXCLUDE USING gist '
+                   '({} WITH =, tsrange(start_time, end_time) WITH &&)'.format(name, column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, column in CONSTRAINTS:
+            op.execute('ALTER TABLE show DROP CONSTRAINT {}'.format(name))
+    with op.batch_alter_table('show_series') as batch_op:
+        batch_op.drop_column('duration')
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.drop_column('end_time')
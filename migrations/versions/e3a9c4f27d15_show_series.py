@@ -0,0 +1,42 @@
+"""show_series for recurring shows
+
+Revision ID: e3a9c4f27d15
+Revises: b5e2c7d81f3a
+Create Date: 2026-10-18 16:21:37.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9c4f27d15'
+down_revision = 'b5e2c7d81f3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_series',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rule', sa.String(length=500), nullable=False),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.Column('last_start_time', sa.DateTime(), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_show_series_venue_id_last_start_time', 'show_series',
+                    ['venue_id', 'last_start_time'], unique=False)
+    op.create_index('ix_show_series_artist_id_last_start_time', 'show_series',
+                    ['artist_id', 'last_start_time'], unique=False)
+    op.create_index('ix_show_series_last_start_time', 'show_series', ['last_start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_series_last_start_time', table_name='show_series')
+    op.drop_index('ix_show_series_artist_id_last_start_time', table_name='show_series')
+    op.drop_index('ix_show_series_venue_id_last_start_time', table_name='show_series')
+    op.drop_table('show_series')
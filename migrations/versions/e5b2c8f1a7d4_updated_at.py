@@ -0,0 +1,36 @@
+"""updated_at on Venue and Artist
+
+Revision ID: e5b2c8f1a7d4
+Revises: a4e7b1d9c3f6
+Create Date: 2026-10-19 00:41:05.936118
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2c8f1a7d4'
+down_revision = 'a4e7b1d9c3f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the existing rows count as changed now, which makes clients fetch
+    # their pages once more
+    now = datetime.datetime.now()
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        rows = sa.table(table, sa.column('updated_at', sa.DateTime))
+        op.execute(rows.update().values(updated_at=now))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
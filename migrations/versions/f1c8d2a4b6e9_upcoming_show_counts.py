@@ -0,0 +1,55 @@
+"""upcoming_show_count on Venue and Artist, and its sweep watermark
+
+Revision ID: f1c8d2a4b6e9
+Revises: e3a9c4f27d15
+Create Date: 2026-10-18 18:02:11.640193
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from dateutil.rrule import rrulestr
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c8d2a4b6e9'
+down_revision = 'e3a9c4f27d15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('upcoming_show_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('Artist', sa.Column('upcoming_show_count', sa.Integer(), nullable=False, server_default='0'))
+    watermark = op.create_table('show_count_watermark',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('swept_until', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # counts as of now, which becomes the watermark
+    now = datetime.datetime.now()
+    op.bulk_insert(watermark, [{'id': 1, 'swept_until': now}])
+    connection = op.get_bind()
+    for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        connection.execute(sa.text(
+            'UPDATE "{table}" SET upcoming_show_count = ('
+            'SELECT count(*) FROM show WHERE show.{column} = "{table}".id '
+            'AND show.start_time > :now)'.format(table=table, column=column)), now=now)
+    series = connection.execute(sa.text(
+        'SELECT venue_id, artist_id, rule, start_time FROM show_series '
+        'WHERE last_start_time > :now'), now=now)
+    for venue_id, artist_id, rule, start_time in series.fetchall():
+        upcoming = sum(1 for occurrence in rrulestr(rule, dtstart=start_time) if occurrence > now)
+        for table, entity_id in (('Venue', venue_id), ('Artist', artist_id)):
+            connection.execute(sa.text(
+                'UPDATE "{}" SET upcoming_show_count = upcoming_show_count + :upcoming '
+                'WHERE id = :id'.format(table)), upcoming=upcoming, id=entity_id)
+
+
+def downgrade():
+    op.drop_table('show_count_watermark')
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('upcoming_show_count')
@@ -0,0 +1,125 @@
+"""Per-request timing of SQL and templates, with N+1 query detection.
+
+Every request records its wall time, the number and total time of SQL
+statements run through any engine, and the time spent rendering templates.
+The figures feed the histograms of metrics.registry (served at /metrics) and,
+when PROFILE_SERVER_TIMING is set, a Server-Timing header the browser's
+developer tools display. A statement run more than PROFILE_N_PLUS_ONE_THRESHOLD
+times in one request, with only its parameters changing, is logged and
+counted as a likely N+1 pattern.
+"""
+
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import registry
+
+request_duration = registry.histogram(
+    'fyyur_request_duration_seconds', 'Wall time of requests', ('endpoint', 'method'))
+request_queries = registry.histogram(
+    'fyyur_request_queries', 'SQL statements run per request', ('endpoint',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250))
+request_sql_duration = registry.histogram(
+    'fyyur_request_sql_duration_seconds', 'Time spent in SQL per request', ('endpoint',))
+request_template_duration = registry.histogram(
+    'fyyur_request_template_duration_seconds', 'Time spent rendering templates per request',
+    ('endpoint',))
+n_plus_one = registry.counter(
+    'fyyur_n_plus_one_total', 'Requests repeating a statement more than the threshold',
+    ('endpoint',))
+
+
+class RequestProfile(object):
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+
+
+def current_profile():
+    return g.get('profile') if has_request_context() else None
+
+
+class TimedTemplate(Template):
+    # includes and extends render inside the outermost render(), so nested
+    # templates are not counted twice
+
+    def render(self, *args, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            profile.template_time += time.perf_counter() - started
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['profile_started'].pop()
+    profile = current_profile()
+    if profile is not None:
+        profile.queries += 1
+        profile.sql_time += time.perf_counter() - started
+        # statements are compiled with placeholders, so the text is the shape
+        profile.statements[statement] += 1
+
+
+class Profiler(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # register before other request hooks so the whole request is timed
+        app.jinja_env.template_class = TimedTemplate
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def start(self):
+        g.profile = RequestProfile()
+
+    def finish(self, response):
+        profile = current_profile()
+        if profile is None:
+            return response
+        duration = time.perf_counter() - profile.started
+        endpoint = request.endpoint or 'unmatched'
+        request_duration.observe(duration, endpoint=endpoint, method=request.method)
+        request_queries.observe(profile.queries, endpoint=endpoint)
+        request_sql_duration.observe(profile.sql_time, endpoint=endpoint)
+        request_template_duration.observe(profile.template_time, endpoint=endpoint)
+
+        threshold = current_app.config['PROFILE_N_PLUS_ONE_THRESHOLD']
+        repeated = [(statement, count) for statement, count in profile.statements.items()
+                    if count > threshold]
+        if repeated:
+            n_plus_one.inc(endpoint=endpoint)
+            for statement, count in repeated:
+                current_app.logger.warning('Possible N+1 in %s %s: statement run %d times: %s',
+                                           request.method, request.path, count,
+                                           ' '.join(statement.split()))
+
+        if current_app.config['PROFILE_SERVER_TIMING']:
+            response.headers['Server-Timing'] = ', '.join([
+                'db;dur={:.1f};desc="{} queries"'.format(profile.sql_time * 1000, profile.queries),
+                'tpl;dur={:.1f}'.format(profile.template_time * 1000),
+                'app;dur={:.1f}'.format(duration * 1000),
+            ])
+        return response
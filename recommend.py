@@ -0,0 +1,149 @@
+"""Artist recommendations for venues, scored for every artist at once.
+
+An ArtistMatrix keeps the artists' features as NumPy arrays, one row per
+artist: their genres as bitsets, codes of their state and of their city,
+whether they are seeking a venue, and how many past shows they played at
+venues of each genre. Scoring a venue is then a handful of whole-array
+operations (an AND and a popcount over the bitsets, comparisons of codes,
+one matrix-vector product) instead of a Python loop over artists, and
+ranking is a partial sort of the scores.
+
+The matrix is built from the database and rebuilt once it is older than
+its max_age, so changes show up in recommendations after at most that
+long. Needs the numpy package.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+# set bits of every byte value, for numpy without bitwise_count
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+# weights of the parts of an artist's score, each part being within 0 and 1
+DEFAULT_WEIGHTS = {'genre': 0.5, 'location': 0.25, 'history': 0.15, 'seeking': 0.1}
+
+
+def popcount(bits):
+    """Set bits per row of a 2-d uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return POPCOUNT[bits.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+def place_key(city, state):
+    return ' '.join((city or '').lower().split()), (state or '').strip().upper()
+
+
+class ArtistMatrix(object):
+
+    def __init__(self, artists, artist_genres, history):
+        """artists are (id, city, state, seeking_venue) rows, artist_genres
+        (artist_id, genre_id) rows and history (artist_id, genre_id, shows)
+        rows counting past shows at venues of a genre."""
+        artists = list(artists)
+        self.ids = np.array([row[0] for row in artists], dtype=np.int64)
+        order = np.argsort(self.ids)
+        artist_genres = np.array([tuple(row) for row in artist_genres], dtype=np.int64).reshape(-1, 2)
+        history = np.array([tuple(row) for row in history], dtype=np.int64).reshape(-1, 3)
+
+        # rows of the artists the genre and history rows name, dropping those
+        # of artists missing from artists
+        def artist_rows(artist_ids):
+            found = np.searchsorted(self.ids, artist_ids, sorter=order).clip(0, max(len(order) - 1, 0))
+            rows = order[found] if len(order) else found
+            return rows, (self.ids[rows] == artist_ids) if len(order) else np.zeros(len(artist_ids), bool)
+
+        genre_rows, known = artist_rows(artist_genres[:, 0])
+        genre_rows, genre_ids = genre_rows[known], artist_genres[known, 1]
+        history_rows, known = artist_rows(history[:, 0])
+        history_rows, history = history_rows[known], history[known]
+
+        genre_list = np.union1d(genre_ids, history[:, 1])
+        self.genre_bits = {genre_id: bit for bit, genre_id in enumerate(genre_list.tolist())}
+        words = max(1, -(-len(genre_list) // 64))
+
+        self.genres = np.zeros((len(artists), words), dtype=np.uint64)
+        bits = np.searchsorted(genre_list, genre_ids)
+        np.bitwise_or.at(self.genres, (genre_rows, bits // 64),
+                         np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)))
+
+        # codes of the places, -1 for none
+        self.places = {}
+        self.states = {}
+        self.city_codes = np.full(len(artists), -1, dtype=np.int32)
+        self.state_codes = np.full(len(artists), -1, dtype=np.int32)
+        for row, (artist_id, city, state, seeking) in enumerate(artists):
+            city, state = place_key(city, state)
+            if state:
+                self.state_codes[row] = self.states.setdefault(state, len(self.states))
+                if city:
+                    self.city_codes[row] = self.places.setdefault((city, state), len(self.places))
+        self.seeking = np.array([bool(row[3]) for row in artists], dtype=np.float32)
+
+        # log-scaled, so a few shows count for more than the hundredth
+        self.history = np.zeros((len(artists), len(genre_list)), dtype=np.float32)
+        self.history[history_rows, np.searchsorted(genre_list, history[:, 1])] = np.log1p(history[:, 2])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, genre_ids, city, state, weights=None):
+        """(score, parts) of every artist for a venue with the given genres
+        and place, parts mapping the names of DEFAULT_WEIGHTS to arrays."""
+        weights = weights or DEFAULT_WEIGHTS
+        bits = np.zeros(self.genres.shape[1], dtype=np.uint64)
+        genre_vector = np.zeros(self.history.shape[1], dtype=np.float32)
+        known = [self.genre_bits[genre_id] for genre_id in set(genre_ids) if genre_id in self.genre_bits]
+        for bit in known:
+            bits[bit // 64] |= np.uint64(1 << (bit % 64))
+            genre_vector[bit] = 1
+
+        parts = {}
+        parts['genre'] = popcount(self.genres & bits) / np.float32(max(len(set(genre_ids)), 1))
+        city, state = place_key(city, state)
+        state_code = self.states.get(state, -2)
+        city_code = self.places.get((city, state), -2)
+        parts['location'] = np.where(self.city_codes == city_code, np.float32(1),
+                                     np.where(self.state_codes == state_code, np.float32(0.5), np.float32(0)))
+        history = self.history @ genre_vector
+        peak = history.max() if len(history) else 0
+        parts['history'] = history / peak if peak > 0 else history
+        parts['seeking'] = self.seeking
+
+        score = np.zeros(len(self.ids), dtype=np.float32)
+        for name, weight in weights.items():
+            score += np.float32(weight) * parts[name]
+        return score, parts
+
+    def rank(self, genre_ids, city, state, limit, weights=None):
+        """[(artist_id, score, parts)] of the best limit artists, best first."""
+        score, parts = self.scores(genre_ids, city, state, weights)
+        limit = min(limit, len(score))
+        if not limit:
+            return []
+        best = np.argpartition(-score, limit - 1)[:limit]
+        # ties broken by id, for a stable order
+        best = best[np.lexsort((self.ids[best], -score[best]))]
+        return [(int(self.ids[row]), float(score[row]),
+                 {name: float(values[row]) for name, values in parts.items()})
+                for row in best]
+
+
+class MatrixCache(object):
+    """The matrix built by loader(), rebuilt once older than max_age seconds."""
+
+    def __init__(self, loader, max_age):
+        self.loader = loader
+        self.max_age = max_age
+        self._matrix = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._matrix is None or time.time() - self._built_at > self.max_age:
+                self._matrix = self.loader()
+                self._built_at = time.time()
+            return self._matrix
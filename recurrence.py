@@ -0,0 +1,64 @@
+"""Recurrence rules of show series, expanded lazily.
+
+A series stores the start time of its first show and an RFC 5545 RRULE
+without DTSTART, e.g. ``FREQ=WEEKLY;BYDAY=TU;COUNT=52``. Rules must end,
+through COUNT or UNTIL, so every series has a last occurrence that can be
+stored and indexed, and expanding one is bounded by MAX_OCCURRENCES.
+"""
+
+from functools import lru_cache
+from itertools import dropwhile, islice, takewhile
+
+from dateutil.rrule import rrule, rrulestr
+
+MAX_OCCURRENCES = 1000
+
+
+@lru_cache(maxsize=1024)
+def parse_rule(rule, start_time):
+    """The dateutil rrule for rule, first occurring at start_time.
+
+    Raises ValueError for rules dateutil cannot parse and for rules without
+    an end.
+    """
+    try:
+        recurrence = rrulestr(rule, dtstart=start_time)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid recurrence rule: {}'.format(e))
+    if not isinstance(recurrence, rrule):
+        raise ValueError('A series takes a single RRULE')
+    if recurrence._count is None and recurrence._until is None:
+        raise ValueError('A recurrence rule needs COUNT or UNTIL')
+    return recurrence
+
+
+def last_occurrence(rule, start_time):
+    """Start time of the last occurrence; raises ValueError as parse_rule does,
+    and for rules with no occurrence or more than MAX_OCCURRENCES."""
+    occurrences = list(islice(parse_rule(rule, start_time), MAX_OCCURRENCES + 1))
+    if not occurrences:
+        raise ValueError('The recurrence rule has no occurrences')
+    if len(occurrences) > MAX_OCCURRENCES:
+        raise ValueError('A series can have at most {} occurrences'.format(MAX_OCCURRENCES))
+    return occurrences[-1]
+
+
+def occurrences_from(rule, start_time, since=None):
+    """Occurrences at or after since, soonest first, generated as consumed."""
+    occurrences = iter(parse_rule(rule, start_time))
+    if since is None:
+        return occurrences
+    return dropwhile(lambda occurrence: occurrence < since, occurrences)
+
+
+def occurrences_until(rule, start_time, until):
+    """Occurrences at or before until, latest first."""
+    return reversed(list(takewhile(lambda occurrence: occurrence <= until,
+                                   parse_rule(rule, start_time))))
+
+
+def count_until(rule, start_time, until):
+    """(occurrences at or before until, occurrences after it)."""
+    recurrence = parse_rule(rule, start_time)
+    past = sum(1 for _ in takewhile(lambda occurrence: occurrence <= until, recurrence))
+    return past, recurrence.count() - past
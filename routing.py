@@ -0,0 +1,113 @@
+"""Read replica selection and the session that routes reads to replicas.
+
+A request marked read-only (see ``RoutingSession.use_replica``) sends its
+queries to one replica, picked round-robin among those that answered the last
+health check and were not further behind the primary than allowed. Anything
+that flushes goes to the primary, as does every request once no replica
+qualifies.
+"""
+
+import itertools
+import threading
+import time
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, text
+
+from metrics import registry
+
+routed_sessions = registry.counter(
+    'fyyur_db_routed_sessions_total',
+    'Read-only requests by the database they were routed to', ('target',))
+
+# Seconds of replay lag, or 0 when the replica has replayed everything it
+# received; an idle primary otherwise looks like a lagging replica
+POSTGRES_LAG_QUERY = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END')
+
+
+class Replica(object):
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag = 0.0
+        self.checked_at = 0.0
+        event.listen(engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            # stop routing here until the next check finds it back up
+            self.healthy = False
+            self.checked_at = time.time()
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == 'postgresql':
+                    self.lag = float(connection.scalar(POSTGRES_LAG_QUERY))
+                else:
+                    # SQLite copies have no replication stream to measure
+                    connection.scalar(text('SELECT 1'))
+                    self.lag = 0.0
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+        self.checked_at = time.time()
+
+
+class ReplicaSet(object):
+
+    def __init__(self, replicas, max_lag=5, check_interval=5):
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._cycle = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def _usable(self, replica):
+        if time.time() - replica.checked_at >= self.check_interval:
+            replica.check()
+        return replica.healthy and replica.lag <= self.max_lag
+
+    def choose(self):
+        """Next usable replica's engine, or None to stay on the primary."""
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = next(self._cycle)
+            if self._usable(replica):
+                return replica.engine
+        return None
+
+    def status(self):
+        return [{
+            'name': replica.name,
+            'healthy': replica.healthy,
+            'lag': replica.lag,
+        } for replica in self.replicas]
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to ``info['replica']`` when one is set."""
+
+    def use_replica(self, replicas):
+        engine = replicas.choose() if replicas else None
+        self.info['replica'] = engine
+        routed_sessions.inc(target='replica' if engine is not None else 'primary')
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not self.info.get('wrote'):
+            return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def record_write(session, flush_context):
+    session.info['wrote'] = True
@@ -0,0 +1,155 @@
+"""In-process trigram search index.
+
+Used for venue and artist search when the database has no trigram index
+support (e.g. SQLite during local development). PostgreSQL deployments use
+the pg_trgm GIN indexes created by the migrations instead.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+def trigrams(text):
+    text = '  {} '.format(text.lower())
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def query_trigrams(term):
+    # only the trigrams inside the term itself; padding would anchor the
+    # term to word boundaries and break partial matching
+    term = term.lower()
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+class TrigramIndex(object):
+    """Maps trigrams to document ids for partial, case-insensitive search.
+
+    Each document is a tuple of text fields, the first field being the one
+    that ranks highest (the name). A search intersects the posting sets of
+    the term's trigrams, so its cost depends on the rarest trigram rather
+    than on the number of documents.
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self._postings = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id, fields):
+        fields = tuple((field or '').lower() for field in fields)
+        with self._lock:
+            self.remove(doc_id)
+            self._docs[doc_id] = fields
+            for gram in set().union(*(trigrams(field) for field in fields)):
+                self._postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            fields = self._docs.pop(doc_id, None)
+            if fields is None:
+                return
+            for gram in set().union(*(trigrams(field) for field in fields)):
+                postings = self._postings.get(gram)
+                if postings is not None:
+                    postings.discard(doc_id)
+                    if not postings:
+                        del self._postings[gram]
+
+    def search(self, term):
+        """Return the ids of documents containing term, best match first."""
+        term = term.lower()
+        with self._lock:
+            grams = query_trigrams(term)
+            if grams:
+                postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            else:
+                # terms shorter than a trigram cannot use the index
+                candidates = self._docs.keys()
+
+            ranked = []
+            for doc_id in candidates:
+                fields = self._docs[doc_id]
+                for rank, field in enumerate(fields):
+                    position = field.find(term)
+                    if position != -1:
+                        ranked.append(((rank, position, len(field), doc_id), doc_id))
+                        break
+        ranked.sort()
+        return [doc_id for _, doc_id in ranked]
+
+
+class SearchIndexes(object):
+    """Lazily built trigram indexes kept in step with committed ORM writes.
+
+    Ids of inserted, updated and deleted rows are collected per session and
+    handed to the index once the session commits; the rows are re-read on
+    the next search. Writes made by other processes are picked up by
+    rebuilding an index once it is older than ``max_age`` seconds.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._loaders = {}
+        self._indexes = {}
+        self._built_at = {}
+        self._stale_ids = {}
+        self._lock = threading.Lock()
+
+    def register(self, model, loader):
+        # loader(ids=None) yields (id, fields) for the given rows, or for
+        # every row when ids is None
+        self._loaders[model] = loader
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, self._record_change)
+
+    def search(self, model, term):
+        return self._index(model).search(term)
+
+    def _index(self, model):
+        loader = self._loaders[model]
+        with self._lock:
+            index = self._indexes.get(model)
+            stale = (self.max_age is not None and
+                     time.time() - self._built_at.get(model, 0) > self.max_age)
+            if index is None or stale:
+                index = TrigramIndex()
+                for doc_id, fields in loader():
+                    index.add(doc_id, fields)
+                self._indexes[model] = index
+                self._built_at[model] = time.time()
+                self._stale_ids.pop(model, None)
+            stale_ids = self._stale_ids.pop(model, None)
+            if stale_ids:
+                for doc_id in stale_ids:
+                    index.remove(doc_id)
+                for doc_id, fields in loader(stale_ids):
+                    index.add(doc_id, fields)
+            return index
+
+    def _record_change(self, mapper, connection, target):
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault('search_index_changes', set()).add((mapper.class_, target.id))
+
+    def apply(self, session):
+        changes = session.info.pop('search_index_changes', ())
+        with self._lock:
+            for model, doc_id in changes:
+                if model in self._indexes:
+                    self._stale_ids.setdefault(model, set()).add(doc_id)
+
+    def discard(self, session):
+        session.info.pop('search_index_changes', None)
+
+    def listen(self, session_class=Session):
+        event.listen(session_class, 'after_commit', self.apply)
+        event.listen(session_class, 'after_soft_rollback',
+                     lambda session, previous_transaction: self.discard(session))
@@ -0,0 +1,29 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+gunicorn.conf.py sets FYYUR_ENV=production and leaves out the `flask db`
+commands (FYYUR_CLI_MIGRATIONS=false); do the same when serving this
+module with anything else. They are not set here because the flask command
+loads this module ahead of app.py when FLASK_APP is not set.
+
+Importing app.py builds the app but opens no database connection, so with
+gunicorn's preload_app the master imports it once and the forked workers
+connect on their first request; a connection that did come from the
+master is dropped on checkout (see database.py). The time the import took
+is logged and exported as fyyur_app_load_seconds, the bulk of a worker's
+cold start without preload.
+"""
+
+import os
+import time
+
+started = time.perf_counter()
+from app import app as application  # noqa: E402
+load_seconds = time.perf_counter() - started
+
+from metrics import registry  # noqa: E402
+
+registry.gauge('fyyur_app_load_seconds', 'Time taken to import the app in this process',
+               lambda: load_seconds)
+application.logger.info('Loaded in %.0f ms (pid %d)', load_seconds * 1000, os.getpid())